@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova asyncio fetch engine
+
+All requests of a search are multiplexed on a single event loop running in
+a background thread, ``Client`` threads only wait for their own response.
+Python 3 only, ``Client`` falls back to urllib when it's not available.
+"""
+
+import io
+import ssl
+import asyncio
+import threading
+from http.client import parse_headers
+from urllib.parse import urlparse, urljoin
+from urllib.request import Request
+
+REQUEST_TIMEOUT = 30
+MAX_REDIRECTS = 10
+MAX_IDLE = 4  # Idle connections kept for each host
+IDEMPOTENT = ('GET', 'HEAD')  # Methods safe to send again on a fresh connection
+
+loop = None
+idle = {}  # Only touched from the loop thread
+loop_lock = threading.Lock()
+
+ssl_context = ssl.create_default_context()
+ssl_context.check_hostname = False
+ssl_context.verify_mode = ssl.CERT_NONE
+
+
+class HTTPError(Exception):
+    """ Raised for responses with an error status, mirrors ``urllib.error.HTTPError``
+    """
+    def __init__(self, code, headers):
+        Exception.__init__(self, "HTTP Error %d" % code)
+        self.code = code
+        self.headers = headers
+
+
+class Response:
+    """ Minimal response object, compatible with what ``CookieJar.extract_cookies`` expects
+
+    Attributes:
+        status   (int): HTTP status code
+        headers (HTTPMessage): Response headers
+        body   (bytes): Raw, possibly compressed, response body
+        url      (str): Final URL after redirects
+    """
+    def __init__(self, status, headers, body, url):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+
+def get_loop():
+    """ Returns the shared event loop, starting its thread on first use
+    """
+    global loop
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever)
+            thread.daemon = True
+            thread.start()
+    return loop
+
+
+def fetch(url, data=None, headers=None, cookies=None, proxy_url=None):
+    """ Blocking entrypoint running a request on the shared event loop
+
+    Args:
+        url        (str): The URL to open
+        data     (bytes): Encoded POST data, or ``None`` for GET
+        headers   (dict): Request headers
+        cookies (CookieJar): Cookie jar to read cookies from and store new ones into
+        proxy_url  (str): HTTP proxy URL, ie. ``http://127.0.0.1:65222``
+
+    Returns:
+        Response: The final response after following redirects
+
+    Raises:
+        HTTPError: When the response status is 400 or above
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        asyncio.wait_for(request(url, data, headers or {}, cookies, proxy_url), REQUEST_TIMEOUT), get_loop())
+    return future.result()
+
+
+async def request(url, data, headers, cookies, proxy_url):
+    for _ in range(MAX_REDIRECTS):
+        req = Request(url, data, headers)
+        if cookies is not None:
+            cookies.add_cookie_header(req)
+        response = await send(req, proxy_url)
+        if cookies is not None:
+            cookies.extract_cookies(response, req)
+
+        location = response.headers.get('Location')
+        if response.status in (301, 302, 303, 307, 308) and location:
+            url = urljoin(url, location)
+            if response.status in (301, 302, 303):
+                data = None
+            continue
+        if response.status >= 400:
+            raise HTTPError(response.status, response.headers)
+        return response
+    raise HTTPError(310, None)
+
+
+async def send(req, proxy_url):
+    parsed = urlparse(req.full_url)
+    secure = parsed.scheme == 'https'
+    port = parsed.port or (443 if secure else 80)
+    target = parsed.path or '/'
+    if parsed.query:
+        target += '?' + parsed.query
+    if proxy_url and not secure:
+        target = req.full_url
+    key = (parsed.scheme, parsed.hostname, port, proxy_url)
+
+    # A stale idle connection means sending the request twice, logins and other posts never take the risk
+    if idle.get(key) and req.get_method() in IDEMPOTENT:
+        reader, writer = idle[key].pop()
+        try:
+            return await exchange(req, target, parsed, reader, writer, key)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Server closed the idle connection meanwhile, retry on a fresh one
+            writer.close()
+
+    reader, writer = await connect(parsed, port, secure, proxy_url)
+    return await exchange(req, target, parsed, reader, writer, key)
+
+
+async def connect(parsed, port, secure, proxy_url):
+    if proxy_url:
+        proxy = urlparse(proxy_url)
+        reader, writer = await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+        if secure:
+            writer.write(('CONNECT %s:%d HTTP/1.1\r\nHost: %s:%d\r\n\r\n' % (parsed.hostname, port, parsed.hostname, port)).encode('latin-1'))
+            status, _ = await read_head(reader)
+            if status != 200:
+                writer.close()
+                raise HTTPError(status, None)
+            if hasattr(writer, 'start_tls'):
+                await writer.start_tls(ssl_context, server_hostname=parsed.hostname)
+            else:
+                # Before Python 3.11 streams can't be upgraded, so swap the transport by hand
+                transport = await asyncio.get_event_loop().start_tls(
+                    writer.transport, writer.transport.get_protocol(), ssl_context, server_hostname=parsed.hostname)
+                writer._transport = transport
+    else:
+        reader, writer = await asyncio.open_connection(
+            parsed.hostname, port, ssl=ssl_context if secure else None, server_hostname=parsed.hostname if secure else None)
+    return reader, writer
+
+
+async def exchange(req, target, parsed, reader, writer, key):
+    reusable = False
+    try:
+        lines = ['%s %s HTTP/1.1' % (req.get_method(), target), 'Host: %s' % parsed.netloc, 'Connection: keep-alive']
+        body = req.data or b''
+        if req.data is not None:
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+            lines.append('Content-Length: %d' % len(body))
+        for name, value in req.header_items():
+            lines.append('%s: %s' % (name, value))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body)
+        await writer.drain()
+
+        status, headers = await read_head(reader)
+        if req.get_method() == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            content = b''
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            content = await read_chunked(reader)
+        elif headers.get('Content-Length'):
+            content = await reader.readexactly(int(headers.get('Content-Length')))
+        else:
+            content = await reader.read()
+            return Response(status, headers, content, req.full_url)  # Body ended with the connection
+        reusable = headers.get('Connection', '').lower() != 'close'
+    finally:
+        if reusable and len(idle.setdefault(key, [])) < MAX_IDLE:
+            idle[key].append((reader, writer))
+        else:
+            writer.close()
+
+    return Response(status, headers, content, req.full_url)
+
+
+async def read_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, _, rest = head.partition(b'\r\n')
+    status = int(status_line.split()[1])
+    return status, parse_headers(io.BytesIO(rest))
+
+
+async def read_chunked(reader):
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+        if not size:
+            # Trailers may follow the last chunk, the body ends with an empty line
+            while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                pass
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    return b''.join(chunks)
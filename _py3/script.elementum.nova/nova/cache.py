@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova persistent caches
+"""
+
+import os
+import json
+import time
+from io import open
+from threading import Lock
+from elementum.provider import log
+from kodi_six import xbmc
+from .utils import ADDON_PROFILE, file_lock
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from .ordereddict import OrderedDict
+
+PATH_PROFILE = xbmc.translatePath(ADDON_PROFILE)
+
+
+class Cache:
+    """
+    Size-bounded LRU cache with expiring entries, persisted as JSON in the addon profile
+
+    Args:
+        name (str): File name of the cache in the addon profile
+        ttl  (int): Seconds an entry stays valid
+        size (int): Maximum number of entries, least recently used ones are evicted first
+    """
+    def __init__(self, name, ttl, size):
+        self.filename = os.path.join(PATH_PROFILE, name)
+        self.ttl = ttl
+        self.size = size
+        self.lock = Lock()
+        self._entries = None
+        self._changed = False
+
+    def _read(self):
+        entries = {}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, encoding='utf-8') as file:
+                    entries = json.load(file)
+            except Exception as e:
+                log.debug("Reading cache %s error: %s" % (self.filename, repr(e)))
+        now = time.time()
+        return dict((key, entry) for key, entry in entries.items() if now - entry[0] < self._ttl(entry))
+
+    def _ttl(self, entry):
+        # Entries may carry a shorter lifetime of their own
+        return entry[3] if len(entry) > 3 else self.ttl
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict(sorted(self._read().items(), key=lambda e: e[1][1]))
+
+    def get(self, key):
+        """ Cached value for a key
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            The cached value, or ``None`` if missing or expired
+        """
+        with self.lock:
+            self._load()
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry[0] >= self._ttl(entry):
+                self._changed = True
+                return None
+            entry[1] = now
+            self._entries[key] = entry
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        """ Stores a value, evicting least recently used entries above the size limit
+
+        Args:
+            key (str): Cache key
+            value: JSON-serializable value
+            ttl (int): Seconds this entry stays valid, defaults to the cache's
+        """
+        with self.lock:
+            self._load()
+            now = time.time()
+            self._entries.pop(key, None)
+            self._entries[key] = [now, now, value] if ttl is None else [now, now, value, ttl]
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._changed = True
+
+    def save(self):
+        """ Writes the cache to the addon profile if anything changed
+
+        Entries saved meanwhile by other processes are merged in, and the file
+        is replaced atomically so readers never see a partial write.
+        """
+        temp = '%s.%d.tmp' % (self.filename, os.getpid())
+        with self.lock:
+            if not self._changed:
+                return
+            try:
+                with file_lock(self.filename):
+                    entries = self._read()
+                    for key, entry in self._entries.items():
+                        if key not in entries or entries[key][1] < entry[1]:
+                            entries[key] = entry
+                    self._entries = OrderedDict(sorted(entries.items(), key=lambda e: e[1][1])[-self.size:])
+                    with open(temp, 'w', encoding='utf-8') as file:
+                        file.write(u'%s' % json.dumps(self._entries))
+                    try:
+                        os.rename(temp, self.filename)
+                    except OSError:
+                        # Windows doesn't replace existing files on rename
+                        os.remove(self.filename)
+                        os.rename(temp, self.filename)
+                self._changed = False
+            except Exception as e:
+                log.debug("Saving cache %s error: %s" % (self.filename, repr(e)))
@@ -9,24 +9,33 @@ import os
 import re
 import ssl
 import sys
+import zlib
+import codecs
+from threading import Lock
 
 from kodi_six import xbmc, xbmcaddon, py2_encode
 from time import sleep
 
 from contextlib import closing
-from elementum.provider import log, get_setting
-from .utils import encode_dict
+from elementum.provider import log
+from .settings import get_setting
+from .utils import encode_dict, file_lock
 
 if PY3:
     from http.cookiejar import LWPCookieJar
     import urllib.request as urllib2
     from urllib.parse import urlparse, urlencode
+    from . import aio
+    from .keepalive import KeepAliveHTTPHandler, KeepAliveHTTPSHandler
     unicode = str
+    HTTP_ERRORS = (urllib2.HTTPError, aio.HTTPError)
 else:
+    aio = None
     from cookielib import LWPCookieJar
     from urllib import urlencode
     from urlparse import urlparse
     import urllib2
+    HTTP_ERRORS = (urllib2.HTTPError,)
 
 try:
     ssl._create_default_https_context = ssl._create_unverified_context
@@ -38,6 +47,7 @@ try:
     PATH_TEMP = xbmc.translatePath("special://temp").decode(sys.getfilesystemencoding(), 'ignore')
 except:
     PATH_TEMP = xbmc.translatePath("special://temp")
+PATH_COOKIES = os.path.join(PATH_TEMP, 'nova')
 
 if get_setting("use_opennic_dns", bool):
     import socket
@@ -50,18 +60,36 @@ if get_setting("use_opennic_dns", bool):
     }
 
     def new_getaddrinfo(*args):
+        # asyncio also passes proto and flags, only the first four arguments are cached
         try:
-            return dns_cache[args]
+            return dns_cache[args[:4]]
         except KeyError:
             res = prv_getaddrinfo(*args)
-            dns_cache[args] = res
+            dns_cache[args[:4]] = res
             return res
 
     socket.getaddrinfo = new_getaddrinfo
 
+READ_SIZE = 65536  # Bytes read from the response at once
+SNIFF_SIZE = 4096  # Only the beginning of the page is searched for a charset
+META_CHARSET = re.compile(br"""<meta(?!\s*(?:name|value)\s*=)[^>]*?charset\s*=[\s"']*([^\s"'/>]*)""", re.IGNORECASE)
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
 # Proxy types
 proxy_types = ["socks4", "socks5", "http", "i2p"]
 
+# Cookies are shared by all clients of the process, cookie files are only read once
+# and only written back when cookies of their domain changed
+cookie_jar = LWPCookieJar()
+cookie_files = {}
+cookie_lock = Lock()
+
+use_asyncio = aio is not None and get_setting("use_asyncio", bool)
+
 class Client:
     """
     Web client class with automatic charset detection and decoding
@@ -69,7 +97,7 @@ class Client:
     def __init__(self, info=None):
         self._counter = 0
         self._cookies_filename = ''
-        self._cookies = LWPCookieJar()
+        self._cookies = cookie_jar
         self.user_agent = USER_AGENT
         self.info = info
         self.proxy_type = None
@@ -77,6 +105,7 @@ class Client:
         self.content = None
         self.status = None
         self.headers = dict()
+        self._opener = None
 
         if get_setting("use_elementum_proxy", bool):
             elementum_addon = xbmcaddon.Addon(id='plugin.video.elementum')
@@ -97,24 +126,59 @@ class Client:
         return urlencode(payload)
 
     def _read_cookies(self, url=''):
-        cookies_path = os.path.join(PATH_TEMP, 'nova')
-        if not os.path.exists(cookies_path):
-            try:
-                os.makedirs(cookies_path)
-            except Exception as e:
-                log.debug("Error creating cookies directory: %s" % repr(e))
-        self._cookies_filename = os.path.join(cookies_path, urlparse(url).netloc + '_cookies.jar')
-        if os.path.exists(self._cookies_filename):
-            try:
-                self._cookies.load(self._cookies_filename)
-            except Exception as e:
-                log.debug("Reading cookies error: %s" % repr(e))
+        self._cookies_filename = os.path.join(PATH_COOKIES, urlparse(url).netloc + '_cookies.jar')
+        with cookie_lock:
+            if self._cookies_filename in cookie_files:
+                return
+            if not os.path.exists(PATH_COOKIES):
+                try:
+                    os.makedirs(PATH_COOKIES)
+                except Exception as e:
+                    log.debug("Error creating cookies directory: %s" % repr(e))
+            if os.path.exists(self._cookies_filename):
+                try:
+                    with file_lock(self._cookies_filename):
+                        self._cookies.load(self._cookies_filename)
+                except Exception as e:
+                    log.debug("Reading cookies error: %s" % repr(e))
+            cookie_files[self._cookies_filename] = self._domain_cookies(url)
+
+    def _domain_cookies(self, url):
+        """ Persistent cookies of the jar matching the domain of an URL
+
+        Returns:
+            tuple: Sorted cookie tuples, to compare and save
+        """
+        host = urlparse(url).netloc.split(':')[0]
+        cookies = []
+        for cookie in self.cookies():
+            if cookie.discard:
+                continue
+            domain = cookie.domain.lstrip('.')
+            if host == domain or host.endswith('.' + domain) or domain.endswith('.' + host):
+                cookies.append((cookie.domain, cookie.path, cookie.name, cookie.value or '', cookie.expires or 0, cookie))
+        return tuple(sorted(cookies, key=lambda c: c[:5]))
 
     def save_cookies(self):
-        try:
-            self._cookies.save(self._cookies_filename)
-        except Exception as e:
-            log.debug("Saving cookies error: %s" % repr(e))
+        """ Writes cookies of the last opened domain back to its file, if they changed
+        """
+        if not self._cookies_filename:
+            return
+        url = 'http://' + os.path.basename(self._cookies_filename)[:-len('_cookies.jar')]
+        with cookie_lock:
+            cookies = self._domain_cookies(url)
+            saved = cookie_files.get(self._cookies_filename, ())
+            if [c[:5] for c in cookies] == [c[:5] for c in saved]:
+                return
+            cookie_files[self._cookies_filename] = cookies
+            jar = LWPCookieJar()
+            for cookie in cookies:
+                jar.set_cookie(cookie[5])
+            try:
+                with file_lock(self._cookies_filename):
+                    jar.save(self._cookies_filename)
+            except Exception as e:
+                log.debug("Saving cookies error: %s" % repr(e))
 
     def _good_spider(self):
         self._counter += 1
@@ -127,7 +191,9 @@ class Client:
         Returns:
             list: A list of saved Cookie objects
         """
-        return self._cookies
+        # The jar is shared with other threads, take a snapshot to iterate safely
+        with self._cookies._cookies_lock:
+            return list(self._cookies)
 
     def open(self, url, language='en', post_data=None, get_data=None):
         """ Opens a connection to a webpage and saves its HTML content in ``self.content``
@@ -149,12 +215,161 @@ class Client:
         data = urlencode(post_data) if len(post_data) > 0 else None
         if data and PY3:
             data = data.encode("utf-8")
-        req = urllib2.Request(url, data)
 
         self._read_cookies(url)
-        log.debug("Cookies for %s: %s" % (repr(url), repr(self._cookies)))
+        log.debug("Cookies for %s: %s" % (repr(url), repr(self.cookies())))
+
+        headers = {
+            'User-Agent': self.user_agent,
+            'Content-Language': language,
+            'Accept-Encoding': 'gzip',
+            'Origin': url,
+            'Referer': url,
+        }
+
+        try:
+            self._good_spider()
+            if self._async_proxy() is not False:
+                response = aio.fetch(url, data, headers, self._cookies, self._async_proxy())
+                self.headers = response.headers
+                self.content = self._decode(url, [response.body])
+            else:
+                with closing(self._open_urllib(url, data, headers)) as response:
+                    self.headers = response.headers
+                    self.content = self._decode(url, iter(lambda: response.read(READ_SIZE), b''))
+
+            self.save_cookies()
+            self.status = response.getcode()
+            result = True
+
+        except HTTP_ERRORS as e:
+            self.status = e.code
+            if hasattr(e, 'close'):
+                # urllib errors hold the response, closing it releases its connection
+                e.close()
+            log.warning("Status for %s : %s" % (repr(url), str(self.status)))
+
+        except urllib2.URLError as e:
+            self.status = repr(e.reason)
+            log.warning("Status for %s : %s" % (repr(url), self.status))
+
+        except Exception as e:
+            import traceback
+            log.error("%s failed with %s:" % (repr(url), repr(e)))
+            map(log.debug, traceback.format_exc().split("\n"))
+
+        log.debug("Status for %s : %s" % (repr(url), str(self.status)))
+
+        return result
+
+    def _decode(self, url, chunks):
+        """ Decompresses and decodes a response body as it is read
+
+        The charset comes from a BOM, the ``Content-Type`` header or a ``<meta>`` tag,
+        only the first ``SNIFF_SIZE`` bytes of the page are searched for the latter.
 
+        Args:
+            url      (str): The requested URL, for logging
+            chunks (iterable): Raw body chunks
+
+        Returns:
+            str: The decoded content, or bytes on Python 2 if no charset was found
+        """
+        if self.headers.get("Content-Encoding", "") == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks = self._decompress(decompressor, chunks)
+        else:
+            chunks = iter(chunks)
+
+        prefix = b''
+        for chunk in chunks:
+            prefix += chunk
+            if len(prefix) >= SNIFF_SIZE:
+                break
+
+        charset = self._sniff_charset(prefix)
+        if charset:
+            log.debug('Decoding charset from %s for %s' % (charset, repr(url)))
+            decoder = codecs.getincrementaldecoder(charset)('replace')
+            content = [decoder.decode(prefix)]
+            for chunk in chunks:
+                content.append(decoder.decode(chunk))
+            content.append(decoder.decode(b'', True))
+            return u''.join(content)
+        return b''.join([prefix] + list(chunks))
+
+    @staticmethod
+    def _decompress(decompressor, chunks):
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    def _sniff_charset(self, prefix):
+        """ Finds the charset of a page from the beginning of its content
+
+        Returns:
+            str: A known codec name, or ``None`` if there is none
+        """
+        for bom, charset in BOMS:
+            if prefix.startswith(bom):
+                return charset
+
+        if PY3:
+            charset = self.headers.get_content_charset()
+        else:
+            charset = self.headers.getparam('charset')
+
+        if not charset:
+            match = META_CHARSET.search(prefix)
+            if match:
+                charset = match.group(1).decode('ascii', 'ignore')
+
+        if charset:
+            try:
+                codecs.lookup(charset)
+            except LookupError:
+                log.debug("Unknown charset %s" % repr(charset))
+                charset = None
+
+        if not charset and PY3:
+            charset = 'utf-8'  # Python 3 consumers expect str content
+        if charset and charset.lower() in ('utf-8', 'utf8'):
+            charset = 'utf-8-sig'  # Changing to utf-8-sig to remove BOM if found on decode from utf-8
+        return charset
+
+    def _async_proxy(self):
+        """ Proxy to use with the asyncio engine
+
+        Returns:
+            str: HTTP proxy URL, ``None`` for a direct connection,
+                or ``False`` if the request has to go through urllib
+        """
+        if not use_asyncio:
+            return False
+        if not get_setting("use_elementum_proxy", bool) or not self.proxy_url:
+            return None
+        if self.proxy_type and self.proxy_type != 2:
+            return False  # SOCKS proxies are only supported by urllib handlers
+        return self.proxy_url
+
+    def _open_urllib(self, url, data, headers):
+        """ Opens a request with a urllib opener
+
+        Returns:
+            HTTPResponse: The response, to be closed by the caller
+        """
+        req = urllib2.Request(url, data)
+        for key, value in iteritems(headers):
+            req.add_header(key, value)
+        if not self._opener:
+            self._opener = self._build_opener()
+        return self._opener.open(req)
+
+    def _build_opener(self):
+        """ Builds the urllib opener of this client, with keep-alive connections when possible
+        """
         handlers = []
+        use_socks = False
 
         if get_setting("use_elementum_proxy", bool) and self.proxy_url:
             if self.proxy_type:
@@ -169,6 +384,7 @@ class Client:
                     from proxy.sockshandler import SocksiPyHandler
                     prx_info = self.proxy_url.split(':')
                     handlers.append(SocksiPyHandler(socks.PROXY_TYPE_SOCKS5, prx_info[1].replace("//", ''), int(prx_info[2])))
+                    use_socks = True
             else:
                 proxyHandler = urllib2.ProxyHandler({
                     'http': self.proxy_url,
@@ -179,59 +395,11 @@ class Client:
         cookieHandler = urllib2.HTTPCookieProcessor(self._cookies)
         handlers.append(cookieHandler)
 
-        opener = urllib2.build_opener(*handlers)
-        req.add_header('User-Agent', self.user_agent)
-        req.add_header('Content-Language', language)
-        req.add_header("Accept-Encoding", "gzip")
-        req.add_header("Origin", url)
-        req.add_header("Referer", url)
-
-        try:
-            self._good_spider()
-            with closing(opener.open(req)) as response:
-                self.headers = response.headers
-                self.save_cookies()
-                if response.headers.get("Content-Encoding", "") == "gzip":
-                    import zlib
-                    self.content = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(response.read())
-                else:
-                    self.content = response.read()
-
-                if PY3:
-                    charset = response.headers.get_content_charset()
-                else:
-                    charset = response.headers.getparam('charset')
-
-                if not charset:
-                    match = re.search("""<meta(?!\s*(?:name|value)\s*=)[^>]*?charset\s*=[\s"']*([^\s"'/>]*)""", self.content)
-                    if match:
-                        charset = match.group(1)
-
-                if charset and charset.lower() == 'utf-8':
-                    charset = 'utf-8-sig'  # Changing to utf-8-sig to remove BOM if found on decode from utf-8
-
-                if charset:
-                    log.debug('Decoding charset from %s for %s' % (charset, repr(url)))
-                    self.content = self.content.decode(charset, 'replace')
-                self.status = response.getcode()
-            result = True
+        if PY3 and not use_socks:
+            handlers.append(KeepAliveHTTPHandler())
+            handlers.append(KeepAliveHTTPSHandler())
 
-        except urllib2.HTTPError as e:
-            self.status = e.code
-            log.warning("Status for %s : %s" % (repr(url), str(self.status)))
-
-        except urllib2.URLError as e:
-            self.status = repr(e.reason)
-            log.warning("Status for %s : %s" % (repr(url), self.status))
-
-        except Exception as e:
-            import traceback
-            log.error("%s failed with %s:" % (repr(url), repr(e)))
-            map(log.debug, traceback.format_exc().split("\n"))
-
-        log.debug("Status for %s : %s" % (repr(url), str(self.status)))
-
-        return result
+        return urllib2.build_opener(*handlers)
 
     def login(self, url, data, fails_with):
         """ Login wrapper around ``open``
@@ -12,9 +12,10 @@ import string
 import hashlib
 
 from .parser.HTMLParser import HTMLParser
-from elementum.provider import log, get_setting
+from elementum.provider import log
+from .settings import get_setting, derived
 from .providers.definitions import definitions
-from .utils import Magnet, get_int, get_float, clean_number, size_int, get_alias
+from .utils import Magnet, get_int, get_float, size_int, get_alias
 if PY3:
     unicode = str
     from urllib.parse import unquote
@@ -23,39 +24,145 @@ else:
 
 from kodi_six.utils import py2_encode
 
+from collections import namedtuple
 try:
     from collections import OrderedDict
 except ImportError:
     from ordereddict import OrderedDict
 
+Release = namedtuple('Release', ['resolution', 'height', 'release_type', 'is_3d', 'remux', 'allowed', 'blocked', 'required'])
+Release.__doc__ = """ Classification of a torrent name by ``FilterSettings.classify``
+
+Attributes:
+    resolution   (str): Resolution filter key, ``filter_480p`` when none matches
+    height       (int): Numeric part of the resolution, ie. ``1080``, used to sort results
+    release_type (str): First matching release type filter key, or ``None``
+    is_3d       (bool): Whether the name has a 3D keyword
+    remux       (bool): Whether the name has a remux keyword
+    allowed     (bool): Whether the name has an allowed release type or resolution keyword
+    blocked     (bool): Whether the name has a blocked keyword
+    required    (bool): Whether the name has all the required keywords
+"""
 
-class Filtering:
+REJECT_EMPTY = 'empty'
+REJECT_RESOLUTION = 'resolution'
+REJECT_TITLE = 'title'
+REJECT_REQUIRED = 'required'
+REJECT_RELEASE_TYPE = 'release_type'
+REJECT_BLOCKED = 'blocked'
+REJECT_SIZE = 'size'
+REJECT_CODES = (REJECT_EMPTY, REJECT_RESOLUTION, REJECT_TITLE, REJECT_REQUIRED, REJECT_RELEASE_TYPE, REJECT_BLOCKED, REJECT_SIZE)
+REASONS = {
+    REJECT_RESOLUTION: "Resolution not allowed",
+    REJECT_TITLE: "Name mismatch",
+    REJECT_REQUIRED: "Missing required keyword",
+    REJECT_RELEASE_TYPE: "Missing release type keyword",
+    REJECT_BLOCKED: "Blocked by release type keyword",
+    REJECT_SIZE: "Size out of range",
+}
+
+matchers = {}
+normalized = {}
+NORMALIZED_SIZE = 4096  # Names normalized for the whole process, the memo is dropped when full
+CLASSIFIED_SIZE = 4096  # Names classified during a search, same as above
+PUNCTUATION = dict((ord(p), ' ') for p in string.punctuation)
+if PY3:
+    BYTES_PUNCTUATION = bytes.maketrans(string.punctuation.encode('ascii'), b' ' * len(string.punctuation))
+else:
+    BYTES_PUNCTUATION = string.maketrans(string.punctuation, b' ' * len(string.punctuation))
+# Unescaping keeps no parser state, so one parser decodes entities for every thread
+entities = HTMLParser()
+
+
+class Rejection:
     """
-    Filtering class
+    Rejected torrent, only formatted into a readable reason when logged
 
-    Attributes:
-        resolutions (OrderedDict): Ordered dictionary of resolution filters to be used depending on settings
-        resolutions_allow  (list): List of resolutions to allow in search results
-        release_types  (dict): Dictionary of release types to be used depending on settings
-        releases_allow (list): List of release types to allow in search results
-        releases_deny  (list): List of release types to deny in search results
-        require_keywords (list): List of keywords to require in search results
-        min_size (float): Minimum required size
-        max_size (float): Maximum possible size
-        filter_title (bool): Whether or not this provider needs titles to be double-checked,
-            typically used for providers that return too many results from their search
-            engine when no results are found (ie. TorLock and TorrentZ)
-        queries (list): List of queries to be filtered
-        extras (list): List of extras to be filtered
-        info (dict): Payload from Elementum
-        kodi_language (str): Language code from Kodi if kodi_language setting is enabled
-        language_exceptions (list): List of providers for which not to apply ``kodi_language`` setting
-        url (str): URL of this filtering request
-        get_data (dict): GET data for client request
-        post_data (dict): POST data for client request
-        title (str): Result title to be used when matching with ``filter_title`` enabled
-        reason (str): Rejection reason when result does not match
-        results (list): Filtered, accepted results
+    Args:
+        provider (str): Provider ID
+        name     (str): Normalized torrent name
+        code     (str): One of the ``REJECT_*`` codes
+    """
+    __slots__ = ('provider', 'name', 'code')
+
+    def __init__(self, provider, name, code):
+        self.provider = provider
+        self.name = name
+        self.code = code
+
+    def __str__(self):
+        return py2_encode(self.format())
+
+    def format(self):
+        """ Readable rejection reason
+
+        Returns:
+            str: The reason, ie. ``[provider] name *** Size out of range``
+        """
+        if self.code == REJECT_EMPTY:
+            return '[%s] %s' % (self.provider, '*** Empty name ***')
+        return "[%s] %70s *** %s" % (self.provider, self.name, REASONS[self.code])
+
+
+class KeywordMatcher:
+    """
+    Keyword groups compiled into a single pattern, telling which groups are included in a string in one pass
+
+    Keywords match like ``Filtering.included`` always did: a keyword is included when all its
+    whitespace-separated items are substrings of the space-padded, lowercased string, with
+    ``_`` standing for a space, and ``strict`` items needing spaces around them. A group is
+    included when any of its keywords is, or always when it has a ``*`` keyword.
+
+    Args:
+        groups (list): List of ``(keys, strict)`` tuples, ``keys`` being a list of keywords
+    """
+    def __init__(self, groups):
+        self.always = set()
+        self.keys = []
+        items = set()
+        for index, (keys, strict) in enumerate(groups):
+            if '*' in keys:
+                self.always.add(index)
+                continue
+            for key in keys:
+                key_items = []
+                for item in re.split(r'\s', key):
+                    item = item.replace('_', ' ').lower()
+                    key_items.append(' ' + item + ' ' if strict else item)
+                items.update(key_items)
+                self.keys.append((index, frozenset(key_items)))
+
+        # Alternatives are tried longest first, so the one found at a position has all the
+        # other items found at that position as prefixes, and implies them.
+        ordered = sorted(items, key=len, reverse=True)
+        self.implies = dict((item, frozenset(other for other in ordered if item.startswith(other))) for item in ordered)
+        self.pattern = re.compile('(?=(%s))' % '|'.join(re.escape(item) for item in ordered)) if ordered else None
+
+    def search(self, value):
+        """ Finds the groups included in a string
+
+        Args:
+            value (str): String to search, usually a torrent name
+
+        Returns:
+            set: Indexes of the included groups
+        """
+        found = set(self.always)
+        if self.pattern is None:
+            return found
+        present = set()
+        for match in self.pattern.finditer(' ' + value.lower() + ' '):
+            present.update(self.implies[match.group(1)])
+        for index, key_items in self.keys:
+            if index not in found and key_items <= present:
+                found.add(index)
+        return found
+
+
+class FilterSettings:
+    """
+    Resolution, release type and keyword filters compiled from settings, built once per search
+    and shared by the ``Filtering`` instances of all providers, see ``Filtering`` for attributes
     """
     def __init__(self):
         resolutions = OrderedDict()
@@ -129,6 +236,96 @@ class Filtering:
 
         self.require_keywords = require
 
+        # Resolutions, release types, allowed and denied keywords, and each required keyword, in that order
+        self.release_type_keys = list(self.release_types)
+        groups = [(self.resolutions[resolution], True) for resolution in self.resolutions]
+        groups.extend((self.release_types[release_type], False) for release_type in self.release_type_keys)
+        groups.append((self.releases_allow, False))
+        groups.append((self.releases_deny, False))
+        groups.extend(([required], False) for required in self.require_keywords or [])
+        self.keywords = KeywordMatcher(groups)
+        self.classified = {}
+
+    def classify(self, name):
+        """ Classifies a name in one pass of ``self.keywords``, results are cached for the search
+
+        Args:
+            name (str): Normalized torrent name
+
+        Returns:
+            Release: The classification of the name
+        """
+        release = self.classified.get(name)
+        if release is not None:
+            return release
+
+        found = self.keywords.search(name)
+        resolutions = [key for index, key in enumerate(self.resolutions) if index in found]
+        resolution = resolutions[-1] if resolutions else 'filter_480p'  # Last match wins, defaults to 480p
+        offset = len(self.resolutions)
+        release_types = [key for index, key in enumerate(self.release_type_keys, offset) if index in found]
+        offset += len(self.release_type_keys)
+        release = Release(
+            resolution=resolution,
+            height=get_int(resolution[7:-1]),
+            release_type=release_types[0] if release_types else None,
+            is_3d='filter_3d' in release_types,
+            remux='filter_remux' in resolutions,
+            allowed=offset in found,
+            blocked=offset + 1 in found,
+            required=all(index in found for index in range(offset + 2, offset + 2 + len(self.require_keywords or []))),
+        )
+
+        if len(self.classified) >= CLASSIFIED_SIZE:
+            self.classified.clear()
+        self.classified[name] = release
+        return release
+
+
+class Filtering:
+    """
+    Filtering class
+
+    Attributes:
+        resolutions (OrderedDict): Ordered dictionary of resolution filters to be used depending on settings
+        resolutions_allow  (list): List of resolutions to allow in search results
+        release_types  (dict): Dictionary of release types to be used depending on settings
+        releases_allow (list): List of release types to allow in search results
+        releases_deny  (list): List of release types to deny in search results
+        require_keywords (list): List of keywords to require in search results
+        keywords (KeywordMatcher): All the above keyword lists compiled into one matcher
+        filters (FilterSettings): Shared filters of the search, classifying names
+        release (Release): Classification of the last verified name
+        min_size (float): Minimum required size
+        max_size (float): Maximum possible size
+        filter_title (bool): Whether or not this provider needs titles to be double-checked,
+            typically used for providers that return too many results from their search
+            engine when no results are found (ie. TorLock and TorrentZ)
+        queries (list): List of queries to be filtered
+        extras (list): List of extras to be filtered
+        info (dict): Payload from Elementum
+        kodi_language (str): Language code from Kodi if kodi_language setting is enabled
+        language_exceptions (list): List of providers for which not to apply ``kodi_language`` setting
+        url (str): URL of this filtering request
+        get_data (dict): GET data for client request
+        post_data (dict): POST data for client request
+        title (str): Result title to be used when matching with ``filter_title`` enabled
+        reason (str): Rejection reason when result does not match
+        results (list): Filtered, accepted results
+    """
+    def __init__(self):
+        filters = derived('filters', FilterSettings)
+        self.resolutions = filters.resolutions
+        self.release_types = filters.release_types
+        self.resolutions_allow = filters.resolutions_allow
+        self.filter_resolutions = filters.filter_resolutions
+        self.releases_allow = filters.releases_allow
+        self.releases_deny = filters.releases_deny
+        self.require_keywords = filters.require_keywords
+        self.keywords = filters.keywords
+        self.filters = filters
+        self.release = None
+
         self.min_size = get_float(get_setting('min_size'))
         self.max_size = get_float(get_setting('max_size'))
         self.check_sizes()
@@ -368,6 +565,8 @@ class Filtering:
     def verify(self, provider, name, size):
         """ Main filtering method to match torrent names, resolutions, release types and size filters
 
+        Sets ``self.reason`` and ``self.release``, so unlike ``verify_batch`` it can't be shared between threads.
+
         Args:
             provider (str): Provider ID
             name     (str): Torrent name
@@ -376,46 +575,69 @@ class Filtering:
         Returns:
             bool: ``True`` if torrent name passed filtering, ``False`` otherwise.
         """
+        code, name, self.release = self.check(name, size, self.title)
+        self.reason = Rejection(provider, name, code).format() if code else "[%s] %70s ***" % (provider, name)
+        return code is None
+
+    def verify_batch(self, provider, candidates):
+        """ Filters a whole page of torrents at once, without changing the instance, so threads can share it
+
+        Args:
+            provider    (str): Provider ID
+            candidates (list): List of ``(name, size)`` tuples, ``size`` being ``None`` to skip size filters
+
+        Returns:
+            tuple: List of ``(index, Release)`` tuples of accepted candidates, and list of
+            ``(index, Rejection)`` tuples of rejected ones, indexes being positions in ``candidates``
+        """
+        accepted = []
+        rejected = []
+        title = self.title
+        for index, (name, size) in enumerate(candidates):
+            code, name, release = self.check(name, size, title)
+            if code is None:
+                accepted.append((index, release))
+            else:
+                rejected.append((index, Rejection(provider, name, code)))
+        return accepted, rejected
+
+    def check(self, name, size, title=''):
+        """ Filters a torrent, reading but never changing the instance
+
+        Args:
+            name  (str): Torrent name
+            size  (str): Arbitrary torrent size to be parsed, or ``None``
+            title (str): Search title names must match when ``filter_title`` is enabled
+
+        Returns:
+            tuple: Rejection code or ``None`` if accepted, normalized name, and ``Release`` or ``None`` for empty names
+        """
         if not name:
-            self.reason = '[%s] %s' % (provider, '*** Empty name ***')
-            return False
+            return REJECT_EMPTY, name, None
 
         name = self.normalize_name(name)
-        if self.filter_title and self.title:
-            self.title = self.normalize_name(self.title)
+        release = self.classify(name)
 
-        self.reason = "[%s] %70s ***" % (provider, name)
+        if self.filter_resolutions and release.resolution not in self.resolutions_allow:
+            return REJECT_RESOLUTION, name, release
 
-        if self.filter_resolutions:
-            resolution = self.determine_resolution(name)
-            if resolution not in self.resolutions_allow:
-                self.reason += " Resolution not allowed"
-                return False
+        if self.filter_title and title:
+            if not all(map(lambda match: match in name, re.split(r'\s', self.normalize_name(title)))):
+                return REJECT_TITLE, name, release
 
-        if self.filter_title:
-            if not all(map(lambda match: match in name, re.split(r'\s', self.title))):
-                self.reason += " Name mismatch"
-                return False
+        if not release.required:
+            return REJECT_REQUIRED, name, release
 
-        if self.require_keywords:
-            for required in self.require_keywords:
-                if not self.included(name, keys=[required]):
-                    self.reason += " Missing required keyword"
-                    return False
+        if not release.allowed:
+            return REJECT_RELEASE_TYPE, name, release
 
-        if not self.included(name, keys=self.releases_allow):
-            self.reason += " Missing release type keyword"
-            return False
-
-        if self.included(name, keys=self.releases_deny):
-            self.reason += " Blocked by release type keyword"
-            return False
+        if release.blocked:
+            return REJECT_BLOCKED, name, release
 
         if size and not self.in_size_range(size):
-            self.reason += " Size out of range"
-            return False
+            return REJECT_SIZE, name, release
 
-        return True
+        return None, name, release
 
     def in_size_range(self, size):
         """ Compares size ranges
@@ -427,7 +649,7 @@ class Filtering:
             bool: ``True`` if file size is within desired range, ``False`` otherwise
         """
         res = False
-        value = size_int(clean_number(size))
+        value = size_int(size)
         min_size = self.min_size * 1e9
         max_size = self.max_size * 1e9
         if min_size <= value <= max_size:
@@ -443,16 +665,24 @@ class Filtering:
         Returns:
             str: The filter key of the determined resolution, see self.resolutions
         """
-        res = 'filter_480p'  # Default to 480p
-        for resolution in self.resolutions:
-            if self.included(name, keys=self.resolutions[resolution], strict=True):
-                res = resolution
-        return res
+        return self.filters.classify(name).resolution
+
+    def classify(self, name):
+        """ Classifies a torrent name, see ``FilterSettings.classify``
+
+        Args:
+            name (str): Name of the torrent, normalized if it isn't already
+
+        Returns:
+            Release: The cached classification of the name
+        """
+        return self.filters.classify(self.normalize_name(name))
 
     def normalize_name(self, value):
         """ Method to normalize strings
 
         Replaces punctuation with spaces, unquotes and unescapes HTML characters.
+        Results are memoized, so titles and names seen again aren't normalized twice.
 
         Args:
             value (str): File name or directory string to convert
@@ -460,16 +690,25 @@ class Filtering:
         Returns:
             str: Converted file name or directory string
         """
-        value = unquote(value)
-        value = self.unescape(value)
-        value = value.lower()
-
-        for p in string.punctuation:
-            value = value.replace(p, ' ')
+        result = normalized.get(value)
+        if result is not None:
+            return result
 
-        value = ' '.join(value.split())
+        result = self.unescape(unquote(value)).lower()
+        if isinstance(result, bytes):
+            result = result.translate(BYTES_PUNCTUATION)
+        else:
+            try:
+                # Translating bytes is several times faster, and most names are plain ASCII
+                result = result.encode('ascii').translate(BYTES_PUNCTUATION).decode('ascii')
+            except UnicodeEncodeError:
+                result = result.translate(PUNCTUATION)
+        result = ' '.join(result.split())
 
-        return value
+        if len(normalized) >= NORMALIZED_SIZE:
+            normalized.clear()
+        normalized[value] = result
+        return result
 
     @classmethod
     def included(self, value, keys, strict=False):
@@ -483,30 +722,16 @@ class Filtering:
         Returns:
             bool: True if any (or all if ``strict``) keys are included, False otherwise.
         """
-        value = ' ' + value + ' '
-        if '*' in keys:
-            res = True
-        else:
-            value = value.lower()
-            res1 = []
-            for key in keys:
-                res2 = []
-                for item in re.split(r'\s', key):
-                    item = item.replace('_', ' ')
-                    if strict:
-                        item = ' ' + item + ' '
-                    if item.lower() in value:
-                        res2.append(True)
-                    else:
-                        res2.append(False)
-                res1.append(all(res2))
-            res = any(res1)
-        return res
+        cache_key = (tuple(keys), strict)
+        matcher = matchers.get(cache_key)
+        if matcher is None:
+            matcher = matchers[cache_key] = KeywordMatcher([(keys, strict)])
+        return 0 in matcher.search(value)
 
     @classmethod
     def unescape(self, name):
         """ Unescapes all HTML entities from a string using
-            HTMLParser().unescape()
+            HTMLParser.unescape()
 
         Args:
             name (str): String to convert
@@ -515,7 +740,7 @@ class Filtering:
             str: Converted string
         """
         name = name.replace('<![CDATA[', '').replace(']]', '')
-        name = HTMLParser().unescape(name.lower())
+        name = entities.unescape(name.lower())
 
         return name
 
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova keep-alive handlers for urllib
+
+Connections are pooled per host and shared by every ``Client`` in the process,
+so a login, a search and its subpages to the same tracker reuse one TCP
+connection, and new TLS connections resume the previous TLS session.
+"""
+
+import ssl
+import socket
+import http.client as httplib
+import urllib.request as urllib2
+from threading import Lock
+
+MAX_IDLE = 4  # Idle connections kept for each host
+
+idle = {}
+sessions = {}
+lock = Lock()
+
+# Loading the CA store is slow, so all handlers share one unverified context
+ssl_context = ssl.create_default_context()
+ssl_context.check_hostname = False
+ssl_context.verify_mode = ssl.CERT_NONE
+
+
+def get_connection(key):
+    with lock:
+        connections = idle.get(key)
+        if connections:
+            return connections.pop()
+    return None
+
+
+def put_connection(key, connection):
+    with lock:
+        connections = idle.setdefault(key, [])
+        if len(connections) < MAX_IDLE:
+            connections.append(connection)
+            return
+    connection.close()
+
+
+def close_all():
+    """ Closes all idle connections
+    """
+    with lock:
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+        idle.clear()
+
+
+class PooledResponse(httplib.HTTPResponse):
+    """ Response giving its connection back to the pool once fully read and closed
+    """
+    pool_key = None
+    connection = None
+
+    def close(self):
+        complete = self.isclosed()  # Body was read to the end
+        httplib.HTTPResponse.close(self)
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            if complete and not self.will_close:
+                put_connection(self.pool_key, connection)
+            else:
+                connection.close()
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    response_class = PooledResponse
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    response_class = PooledResponse
+
+    def connect(self):
+        """ Same as ``HTTPSConnection.connect``, resuming the last TLS session of the host
+        """
+        httplib.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=sessions.get(server_hostname))
+        if self.sock.session:
+            sessions[server_hostname] = self.sock.session
+
+
+class KeepAliveMixin:
+    def keep_alive_open(self, http_class, req, **kwargs):
+        host = req.host
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (http_class, host, req._tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        if req._tunnel_host:
+            tunnel_headers = {}
+            if 'Proxy-Authorization' in headers:
+                tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        connection = get_connection(key)
+        if connection is not None:
+            try:
+                return self._request(connection, key, req, headers)
+            except (socket.error, httplib.HTTPException):
+                # Server closed the idle connection meanwhile, retry on a fresh one
+                connection.close()
+
+        connection = http_class(host, timeout=req.timeout, **kwargs)
+        if req._tunnel_host:
+            connection.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+        try:
+            return self._request(connection, key, req, headers)
+        except socket.error as e:
+            connection.close()
+            raise urllib2.URLError(e)
+
+    def _request(self, connection, key, req, headers):
+        connection.request(req.get_method(), req.selector, req.data, headers)
+        response = connection.getresponse()
+        response.pool_key = key
+        response.connection = connection
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, urllib2.HTTPHandler):
+    def http_open(self, req):
+        return self.keep_alive_open(HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, urllib2.HTTPSHandler):
+    def __init__(self):
+        urllib2.HTTPSHandler.__init__(self, context=ssl_context)
+
+    def https_open(self, req):
+        return self.keep_alive_open(HTTPSConnection, req, context=self._context)
@@ -10,29 +10,40 @@ from future.utils import PY3, iteritems
 import re
 import json
 import time
-from threading import Thread
-from elementum.provider import append_headers, get_setting, log
+import hashlib
+from threading import Lock
+from elementum.provider import append_headers, log
 if PY3:
-    from queue import Queue
+    from queue import Queue, Empty
     from urllib.parse import urlparse
     basestring = str
     long = int
 else:
-    from  Queue import Queue
+    from  Queue import Queue, Empty
     from urlparse import urlparse
-from .parser.ehp import Html
+from .parser.ehp import parser
 from kodi_six import xbmc, xbmcgui, xbmcaddon, py2_encode
 
+from . import stats
+from . import telemetry
+from .cache import Cache
+from .pool import Pool, PRIORITY_PROVIDER, PRIORITY_SUBPAGE
 from .provider import process
-from .providers.definitions import definitions, longest
+from .settings import get_setting, snapshot
+from .providers.definitions import definitions, longest, parser_expression, row_plan
 from .filtering import apply_filters, Filtering, cleanup_results
 from .client import USER_AGENT, Client
-from .utils import ADDON_ICON, notify, translation, sizeof, get_icon_path, get_enabled_providers, get_alias
+from .utils import ADDON_ICON, notify, translation, sizeof, get_icon_path, get_enabled_providers, get_alias, get_int
 
 provider_names = []
+provider_ends = {}  # Time by which each pending provider must be done
 provider_results = []
-provider_cache = {}
+provider_lock = Lock()
+provider_done = Queue()
+provider_pool = None
+provider_hashes = set()
 available_providers = 0
+enough_results = False
 request_time = time.time()
 
 use_kodi_language = get_setting('kodi_language', bool)
@@ -40,8 +51,20 @@ auto_timeout = get_setting("auto_timeout", bool)
 timeout = get_setting("timeout", int)
 debug_parser = get_setting("use_debug_parser", bool)
 max_results = get_setting('max_results', int)
+max_threads = get_setting('max_threads', int)
 disable_max = get_setting('disable_max', bool)
 sort_by_res = get_setting('sort_by_resolution', bool)
+early_exit = get_setting('early_exit', bool)
+early_exit_results = get_setting('early_exit_results', int)
+early_exit_seeds = get_setting('early_exit_seeds', int)
+early_exit_resolution = ['', 'filter_720p', 'filter_1080p', 'filter_2160p'][get_setting('early_exit_resolution', int)]
+early_exit_filter = None
+skip_slow_providers = get_setting('skip_slow_providers', bool)
+cache_ttl = get_setting('cache_ttl', int)
+save_filter_stats = get_setting('save_filter_stats', bool)
+results_cache = Cache('results_cache.json', cache_ttl * 60, 50)
+subpage_cache = Cache('subpage_cache.json', 30 * 24 * 3600, 5000)
+guessed_link_ttl = 24 * 3600  # Links guessed from a subpage may be wrong, or change with the page
 
 special_chars = "()\"':.[]<>/\\?"
 elementum_timeout = 0
@@ -112,16 +135,25 @@ def search(payload, method="general"):
         payload['silent'] = False
 
     global request_time
-    global provider_cache
     global provider_names
+    global provider_ends
     global provider_results
     global available_providers
+    global provider_done
+    global provider_pool
+    global provider_hashes
+    global enough_results
+    global early_exit_filter
 
-    provider_cache = {}
     provider_names = []
     provider_results = []
+    provider_done = Queue()
+    provider_hashes = set()
     available_providers = 0
+    enough_results = False
     request_time = time.time()
+    snapshot()
+    telemetry.reset()
 
     providers = get_enabled_providers(method)
 
@@ -131,6 +163,18 @@ def search(payload, method="general"):
         log.error("No providers enabled")
         return []
 
+    if cache_ttl:
+        key = cache_key(method, payload, providers)
+        cached = results_cache.get(key)
+        if cached is not None:
+            log.info("Returning %d cached results" % len(cached))
+            return cached
+
+    providers, deadlines, skipped = stats.schedule(providers, timeout, skip_slow_providers)
+    if not providers:
+        log.warning("All providers are too slow, using them anyway")
+        providers = skipped
+
     log.info("Searching' with %s" % ", ".join([definitions[provider]['name'] for provider in providers]))
 
     if use_kodi_language:
@@ -146,49 +190,105 @@ def search(payload, method="general"):
     if not payload['silent']:
         p_dialog.create('Elementum [COLOR FF5CB9FF]Nova[/COLOR]', translation(32061))
 
-    providers_time = time.time()
+    if early_exit and early_exit_filter is None:
+        early_exit_filter = Filtering()
 
-    for provider in providers:
-        available_providers += 1
-        provider_names.append(definitions[provider]['name'])
-        task = Thread(target=run_provider, args=(provider, payload, method, providers_time, timeout))
-        task.start()
-
-    total = float(available_providers)
-
-    # Exit if all providers have returned results or timeout reached, check every 100ms
-    while time.time() - providers_time < timeout and available_providers > 0:
-        timer = time.time() - providers_time
-        log.debug("Timer: %ds / %ds" % (timer, timeout))
-        if timer > timeout:
-            break
-        message = translation(32062) % available_providers if available_providers > 1 else translation(32063)
-        if not payload['silent']:
-            p_dialog.update(int((total - available_providers) / total * 100), message=message)
-        time.sleep(0.25)
+    providers_time = time.time()
+    provider_pool = Pool(max_threads if max_threads > 0 else len(providers))
+    # Queued providers may start any time before the search is over, see run_provider
+    provider_ends = dict((definitions[provider]['name'], providers_time + timeout) for provider in providers)
+    try:
+        for provider in providers:
+            available_providers += 1
+            provider_names.append(definitions[provider]['name'])
+            provider_pool.submit(PRIORITY_PROVIDER, None, run_provider, provider, payload, method, providers_time, timeout, deadlines.get(provider, timeout))
+
+        total = float(available_providers)
+
+        # Exit if all providers have returned results or timeout reached, wake up on every finished provider
+        while available_providers > 0 and not enough_results:
+            timer = time.time() - providers_time
+            with provider_lock:
+                budget = max([provider_ends[name] for name in provider_names] or [providers_time + timeout]) - providers_time
+            log.debug("Timer: %ds / %ds" % (timer, budget))
+            if timer >= budget:
+                break
+            message = translation(32062) % available_providers if available_providers > 1 else translation(32063)
+            if not payload['silent']:
+                p_dialog.update(int((total - available_providers) / total * 100), message=message)
+            try:
+                provider_done.get(timeout=budget - timer)
+            except Empty:
+                break
+    finally:
+        # Workers and statistics are cleaned up even if the search itself failed
+        provider_pool.shutdown()
+        subpage_cache.save()
+        stats.abandon(failed=not enough_results)
+        stats.save_stats()
 
     if not payload['silent']:
         p_dialog.close()
     del p_dialog
 
-    if available_providers > 0:
-        message = ', '.join(provider_names)
+    # Late providers may still be writing, so work on a snapshot
+    with provider_lock:
+        pending_names = list(provider_names)
+        results = list(provider_results)
+
+    if pending_names and enough_results:
+        log.info("Got enough results, not waiting for %s" % ', '.join(pending_names))
+    elif pending_names:
+        message = ', '.join(pending_names)
         message = message + translation(32064)
         log.warning(message)
         if not payload['silent']:
             notify(message, ADDON_ICON)
 
-    log.debug("all provider_results of %d: %s" % (len(provider_results), repr(provider_results)))
+    log.debug("all provider_results of %d: %s" % (len(results), repr(results)))
 
-    filtered_results = apply_filters(provider_results)
+    filtered_results = apply_filters(results)
 
     log.debug("all filtered_results of %d: %s" % (len(filtered_results), repr(filtered_results)))
 
+    summary = telemetry.summary(method)
+    if save_filter_stats:
+        telemetry.save(summary)
+
     log.info("Providers returned %d results in %s seconds" % (len(filtered_results), round(time.time() - request_time, 2)))
 
+    # Don't cache incomplete searches, slow providers would be missing until the entry expires
+    if cache_ttl and filtered_results and (not pending_names or enough_results):
+        results_cache.set(key, filtered_results)
+        results_cache.save()
+
     return filtered_results
 
 
+def cache_key(method, payload, providers):
+    """ Results cache key for a search
+
+    Args:
+        method     (str): Type of search
+        payload   (dict): Search payload from Elementum
+        providers (list): Enabled provider IDs
+
+    Returns:
+        str: Hash of everything that affects search results
+    """
+    filtering = Filtering()
+    settings = [filtering.resolutions_allow, filtering.releases_allow, filtering.releases_deny, filtering.require_keywords]
+    for setting in ['min_size', 'max_size', 'separate_sizes', 'min_size_movies', 'max_size_movies', 'min_size_seasons',
+                    'max_size_seasons', 'min_size_episodes', 'max_size_episodes', 'language_exceptions', 'allow_noseeds']:
+        settings.append(get_setting(setting))
+    settings.extend([get_setting("%s_alias" % provider) for provider in providers])
+    settings.extend([max_results, disable_max, sort_by_res, xbmc.getLanguage(xbmc.ISO_639_1) if use_kodi_language else ''])
+
+    query = dict((k, v) for k, v in iteritems(payload) if k not in ('silent', 'proxy_url', 'internal_proxy_url', 'elementum_url'))
+    data = json.dumps([method, query, sorted(providers), settings], sort_keys=True)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
 def got_results(provider, results):
     """ Results callback once a provider found all its results, or not
 
@@ -199,6 +299,7 @@ def got_results(provider, results):
     global provider_names
     global provider_results
     global available_providers
+    global enough_results
     global max_results
 
     definition = definitions[provider]
@@ -220,10 +321,71 @@ def got_results(provider, results):
         provider, definition['name'].rjust(longest), len(results), round(time.time() - request_time, 2),
         (", sending %d best ones" % max_results) if len(results) > max_results else ""))
 
-    provider_results.extend(sorted_results)
-    available_providers -= 1
-    if definition['name'] in provider_names:
-        provider_names.remove(definition['name'])
+    with provider_lock:
+        provider_results.extend(sorted_results)
+        available_providers -= 1
+        if definition['name'] in provider_names:
+            provider_names.remove(definition['name'])
+        if early_exit and not enough_results and count_good_results(sorted_results) >= early_exit_results:
+            enough_results = True
+    provider_done.put(provider)
+
+
+def count_good_results(results):
+    """ Counts de-duplicated results good enough to stop searching early
+
+    Results count when they have at least ``early_exit_seeds`` seeds and
+    the ``early_exit_resolution`` resolution or better.
+
+    Args:
+        results (list): New results from a provider
+
+    Returns:
+        int: Total number of good results in this search so far
+    """
+    resolutions = list(early_exit_filter.resolutions)
+    min_resolution = resolutions.index(early_exit_resolution) if early_exit_resolution else 0
+    for result in results:
+        if not result['uri'] or get_int(result['seeds']) < early_exit_seeds:
+            continue
+        if min_resolution and resolutions.index(early_exit_filter.classify(result['name']).resolution) < min_resolution:
+            continue
+        provider_hashes.add(result['info_hash'].upper() or result['uri'])
+    return len(provider_hashes)
+
+
+def content_window(provider, definition, content):
+    """ Cuts a page down to its results, from the ``content_start`` marker of a definition
+    up to and including its ``content_end`` marker, when it has them
+
+    The row expression of the definition must match the same rows on the window and on
+    the whole page, which is parsed instead when a marker can't be found.
+
+    Args:
+        provider    (str): Provider ID
+        definition (dict): Provider definition
+        content     (str): Page content
+
+    Returns:
+        str: The results region, or the whole page
+    """
+    start_marker = definition.get('content_start')
+    end_marker = definition.get('content_end')
+    if not start_marker and not end_marker:
+        return content
+
+    start = content.find(start_marker) if start_marker else 0
+    end = len(content)
+    if start >= 0 and end_marker:
+        end = content.find(end_marker, start)
+    if start < 0 or end < 0:
+        log.debug("[%s] Content window markers not found, parsing the whole page" % provider)
+        return content
+
+    if end_marker:
+        end += len(end_marker)
+    log.debug("[%s] Parsing %d characters out of %d in content window" % (provider, end - start, len(content)))
+    return content[start:end]
 
 
 def extract_torrents(provider, client):
@@ -243,8 +405,6 @@ def extract_torrents(provider, client):
     if not client.content:
         raise StopIteration
 
-    dom = Html().feed(client.content)
-
     row_search = "dom." + definition['parser']['row']
     name_search = definition['parser']['name']
     torrent_search = definition['parser']['torrent']
@@ -253,10 +413,18 @@ def extract_torrents(provider, client):
     seeds_search = definition['parser']['seeds']
     peers_search = definition['parser']['peers']
 
+    row_code = parser_expression(definition, 'row')
+    name_code = parser_expression(definition, 'name')
+    torrent_code = parser_expression(definition, 'torrent')
+    info_hash_code = parser_expression(definition, 'infohash')
+    size_code = parser_expression(definition, 'size')
+    seeds_code = parser_expression(definition, 'seeds')
+    peers_code = parser_expression(definition, 'peers')
+
     log.debug("[%s] Parser: %s" % (provider, repr(definition['parser'])))
 
     q = Queue()
-    threads = []
+    tasks = []
     needs_subpage = 'subpage' in definition and definition['subpage']
 
     if needs_subpage:
@@ -266,7 +434,8 @@ def extract_torrents(provider, client):
             except Exception as e:
                 import traceback
                 log.error("[%s] Subpage logging failed with: %s" % (provider, repr(e)))
-                map(log.debug, traceback.format_exc().split("\n"))
+                for line in traceback.format_exc().split("\n"):
+                    log.debug(line)
 
             # New client instance, otherwise it's race conditions all over the place
             subclient = Client()
@@ -274,48 +443,65 @@ def extract_torrents(provider, client):
             uri = torrent.split('|')  # Split cookies for private trackers
             subclient.open(py2_encode(uri[0]))
 
+            link = None
             if 'bittorrent' in subclient.headers.get('content-type', ''):
                 log.debug('[%s] bittorrent content-type for %s' % (provider, repr(torrent)))
+                link = uri[0]
                 if len(uri) > 1:  # Stick back cookies if needed
                     torrent = '%s|%s' % (torrent, uri[1])
             else:
                 try:
-                    torrent = extract_from_page(provider, subclient.content)
+                    link = torrent = extract_from_page(provider, subclient.content)
                     if torrent and not torrent.startswith('magnet') and len(uri) > 1:  # Stick back cookies if needed
                         torrent = '%s|%s' % (torrent, uri[1])
                 except Exception as e:
                     import traceback
                     log.error("[%s] Subpage extraction for %s failed with: %s" % (provider, repr(uri[0]), repr(e)))
-                    map(log.debug, traceback.format_exc().split("\n"))
+                    for line in traceback.format_exc().split("\n"):
+                        log.debug(line)
 
             log.debug("[%s] Subpage torrent for %s: %s" % (provider, repr(uri[0]), torrent))
             ret = (name, info_hash, torrent, size, seeds, peers)
-            provider_cache[uri[0]] = torrent
+            if link:
+                # Magnets and served torrents never change, other links found on the page are a guess
+                link_ttl = None if link == uri[0] or link.startswith('magnet') else guessed_link_ttl
+                # Cookies are not cached, they are stuck back from the current session on use
+                subpage_cache.set(uri[0], link, link_ttl)
             q.put_nowait(ret)
 
-    if not dom:
-        if debug_parser:
-            log.debug("[%s] Parser debug | Could not parse DOM from page content" % provider)
+    # Tokenizer backend, the default one unless the definition picks another
+    backend = definition.get('parser_backend')
+    content = content_window(provider, definition, client.content)
+    plan = row_plan(definition)
+    if plan and not debug_parser:
+        # Only the rows are built, the rest of the page is discarded while it's parsed
+        rows = parser(backend).rows(content, *plan)
+    else:
+        dom = parser(backend).feed(content)
+        if not dom:
+            if debug_parser:
+                log.debug("[%s] Parser debug | Could not parse DOM from page content" % provider)
 
-        raise StopIteration
+            raise StopIteration
 
-    if debug_parser:
-        log.debug("[%s] Parser debug | Page content: %s" % (provider, client.content.replace('\r', '').replace('\n', '')))
-        log.debug("[%s] Parser debug | Matched %d items for '%s' query '%s'" % (provider, len(eval(row_search)), 'row', row_search))
+        rows = eval(row_code)
+        if debug_parser:
+            log.debug("[%s] Parser debug | Page content: %s" % (provider, content.replace('\r', '').replace('\n', '')))
+            log.debug("[%s] Parser debug | Matched %d items for '%s' query '%s'" % (provider, len(rows), 'row', row_search))
 
-    for item in eval(row_search):
+    for item in rows:
         if debug_parser:
             item_str = item.__str__()
             log.debug("[%s] Parser debug | Matched '%s' iteration for query '%s': %s" % (provider, 'row', row_search, item_str.replace('\r', '').replace('\n', '')))
 
         if not item:
             continue
-        name = eval(name_search)
-        torrent = eval(torrent_search) if torrent_search else ""
-        size = eval(size_search) if size_search else ""
-        seeds = eval(seeds_search) if seeds_search else ""
-        peers = eval(peers_search) if peers_search else ""
-        info_hash = eval(info_hash_search) if info_hash_search else ""
+        name = eval(name_code)
+        torrent = eval(torrent_code) if torrent_code else ""
+        size = eval(size_code) if size_code else ""
+        seeds = eval(seeds_code) if seeds_code else ""
+        peers = eval(peers_code) if peers_code else ""
+        info_hash = eval(info_hash_code) if info_hash_code else ""
 
         if debug_parser:
             log.debug("[%s] Parser debug | Matched '%s' iteration for query '%s': %s" % (provider, 'name', name_search, name))
@@ -334,7 +520,7 @@ def extract_torrents(provider, client):
             cookie_domain = '{uri.netloc}'.format(uri=parsed_url).replace('www.', '')
             cookies = []
             log.debug("[%s] cookie_domain: %s" % (provider, cookie_domain))
-            for cookie in client._cookies:
+            for cookie in client.cookies():
                 log.debug("[%s] cookie for domain: %s (%s=%s)" % (provider, cookie.domain, cookie.name, cookie.value))
                 if cookie_domain in cookie.domain:
                     cookies.append(cookie)
@@ -349,23 +535,24 @@ def extract_torrents(provider, client):
                 torrent = definition['root_url'] + py2_encode(torrent)
                 # Check if this url was previously requested, to avoid doing same job again.
             uri = torrent.split('|')
-            if uri and uri[0] and uri[0] in provider_cache and provider_cache[uri[0]]:
-                yield (name, info_hash, provider_cache[uri[0]], size, seeds, peers)
+            cached = subpage_cache.get(uri[0]) if uri and uri[0] else None
+            if cached:
+                if not cached.startswith('magnet') and len(uri) > 1:  # Stick back cookies if needed
+                    cached = '%s|%s' % (cached, uri[1])
+                yield (name, info_hash, cached, size, seeds, peers)
                 continue
 
-            t = Thread(target=extract_subpage, args=(q, name, torrent, size, seeds, peers, info_hash))
-            threads.append(t)
+            host = urlparse(uri[0]).netloc
+            tasks.append(provider_pool.submit(PRIORITY_SUBPAGE, host, extract_subpage, q, name, torrent, size, seeds, peers, info_hash))
         else:
             yield (name, info_hash, torrent, size, seeds, peers)
 
     if needs_subpage:
-        log.debug("[%s] Starting subpage threads..." % provider)
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+        log.debug("[%s] Waiting for %d subpage tasks..." % (provider, len(tasks)))
+        for t in tasks:
+            t.wait()
 
-        log.debug("[%s] Threads returned: %s" % (provider, repr(threads)))
+        log.debug("[%s] Subpage tasks returned: %d" % (provider, len(tasks)))
 
         for i in range(q.qsize()):
             ret = q.get_nowait()
@@ -513,18 +700,56 @@ def extract_from_page(provider, content):
     return None
 
 
-def run_provider(provider, payload, method, start_time, timeout):
+def run_provider(provider, payload, method, search_time, search_timeout, deadline):
     """ Provider thread entrypoint
 
+    The provider gets its whole deadline from the moment it starts, so time spent
+    queued in the pool isn't taken from it, but never more than what's left of the search.
+
     Args:
-        provider   (str): Provider ID
-        payload   (dict): Search payload from Elementum
-        method     (str): Type of search, can be ``general``, ``movie``, ``show``, ``season`` or ``anime``
-        start_time (int): Time when search has been started
-        timeout    (int): Time limit for searching
+        provider       (str): Provider ID
+        payload       (dict): Search payload from Elementum
+        method         (str): Type of search, can be ``general``, ``movie``, ``show``, ``season`` or ``anime``
+        search_time  (float): Time when providers of the search have been started
+        search_timeout (int): Time limit for the whole search
+        deadline     (float): Time limit for this provider, see ``stats.schedule``
     """
     log.debug("[%s] Processing %s with %s method" % (provider, provider, method))
+    start_time = time.time()
+    timeout = min(deadline, search_time + search_timeout - start_time)
+    with provider_lock:
+        provider_ends[definitions[provider]['name']] = start_time + timeout
+    stats.start(provider)
 
+    try:
+        results = run_process(provider, payload, method, start_time, timeout)
+    except Exception as e:
+        import traceback
+        log.error("[%s] Provider failed with: %s" % (provider, repr(e)))
+        map(log.debug, traceback.format_exc().split("\n"))
+        stats.finish(provider, failed=True)
+        got_results(provider, [])
+        return
+
+    stats.finish(provider)
+    # Cleanup results from duplcates before limiting each provider's results.
+    #results = cleanup_results(results)
+    got_results(provider, results)
+
+
+def run_process(provider, payload, method, start_time, timeout):
+    """ Sets up filtering for the search method and processes the provider
+
+    Args:
+        provider     (str): Provider ID
+        payload     (dict): Search payload from Elementum
+        method       (str): Type of search, can be ``general``, ``movie``, ``show``, ``season`` or ``anime``
+        start_time (float): Time when the provider has been started
+        timeout    (float): Time limit for the provider
+
+    Returns:
+        list: Filtered results of the provider
+    """
     filterInstance = Filtering()
 
     if method == 'movie':
@@ -542,10 +767,7 @@ def run_provider(provider, payload, method, start_time, timeout):
         results = process(provider=provider, generator=extract_from_api, filtering=filterInstance, has_special=payload['has_special'], start_time=start_time, timeout=timeout)
     else:
         results = process(provider=provider, generator=extract_torrents, filtering=filterInstance, has_special=payload['has_special'], start_time=start_time, timeout=timeout)
-
-    # Cleanup results from duplcates before limiting each provider's results.
-    #results = cleanup_results(results)
-    got_results(provider, results)
+    return results
 
 def nonesorter(a):
     return "" if not a else a
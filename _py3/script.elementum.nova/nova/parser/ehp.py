@@ -15,8 +15,11 @@ from future.utils import PY3
 
 if PY3:
     from future.builtins import range as xrange
-from .HTMLParser import HTMLParser
+from .HTMLParser import HTMLParser, starttagopen, charref, entityref, incomplete
 from collections import deque
+import re
+from itertools import islice
+from bisect import bisect_left
 
 version = '1.3b'
 DATA = 1
@@ -26,6 +29,8 @@ PI = 4
 CODE = 5
 AMP = 6
 
+INDEXED_ATTRIBUTES = ('id', 'class')
+
 
 class Attribute(dict):
     """
@@ -43,6 +48,22 @@ class Attribute(dict):
     It would change to color blue.
     """
 
+    __slots__ = ('_index',)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._index = None
+
+    def __setitem__(self, key, value):
+        if self._index is not None and key in INDEXED_ATTRIBUTES:
+            self._index.valid = False
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self._index is not None and key in INDEXED_ATTRIBUTES:
+            self._index.valid = False
+        dict.__delitem__(self, key)
+
     def __getitem__(self, key):
         # """
         # If self doesn't have the key it returns ""
@@ -56,12 +77,72 @@ class Attribute(dict):
         # which are inside self.
         # """
 
-        data = ''
-        for key, value in self.items():
-            pair = '%s="%s" ' % (key, value)
-            data += pair
+        return ''.join(['%s="%s" ' % (key, value) for key, value in self.items()])
+
+
+class Index(object):
+    """
+    Tag name and attribute indexes of a parsed document.
+
+    Nodes are numbered in the order sail() yields them, so the descendants of
+    a node are the contiguous run of numbers between its first descendant and
+    itself, and matches below any node are found by bisecting the index lists.
+    Any mutation of the tree marks the index as invalid, searches then fall
+    back to sail().
+    """
+
+    def __init__(self):
+        self.tags = {}
+        self.attributes = {}
+        self.valid = True
+
+    def add(self, item):
+        """
+        Adds a node, nodes must be added in sail() order.
+        """
+
+        if not isinstance(item.name, int):
+            self._append(self.tags, item.name, item)
+        for key in INDEXED_ATTRIBUTES:
+            value = item._attr.get(key) if item._attr else None
+            if value:
+                for token in set(value.split()):
+                    self._append(self.attributes, (key, token), item)
 
-        return data
+    @staticmethod
+    def _append(index, key, item):
+        entry = index.get(key)
+        if entry is None:
+            entry = index[key] = ([], [])
+        entry[0].append(item._post)
+        entry[1].append(item)
+
+    @staticmethod
+    def _below(entry, root):
+        if entry is None:
+            return []
+        positions, items = entry
+        return items[bisect_left(positions, root._first):bisect_left(positions, root._post)]
+
+    def find(self, root, name, args):
+        """
+        Returns the candidates for Root.find below root, in sail() order,
+        or None if they can't be looked up.
+        """
+
+        if not self.valid or isinstance(name, int):
+            return None
+
+        if len(args) == 1 and args[0][0] in INDEXED_ATTRIBUTES:
+            key, values = args[0]
+            matches = {}
+            for value in (values if isinstance(values, list) else [values]):
+                for item in self._below(self.attributes.get((key, value)), root):
+                    if item.name == name:
+                        matches[item._post] = item
+            return [matches[position] for position in sorted(matches)]
+
+        return self._below(self.tags.get(name), root)
 
 
 class Root(list):
@@ -79,29 +160,107 @@ class Root(list):
 
     """
 
+    # Nodes are slotted, and their attributes only allocated when there are any,
+    # documents have hundreds of thousands of them. _index, _first and _post are
+    # set by Tree for parsed nodes, see Index.
+    __slots__ = ('name', '_attr', '_index', '_first', '_post', '_text')
+
     def __init__(self, name=None, attr=None):
         # """
         # """
 
-        if attr is None:
-            attr = {}
         self.name = name
-        self.attr = Attribute(attr)
-        list.__init__(list(self))
+        self._attr = Attribute(attr) if attr else None
+        self._index = None
+        self._first = self._post = 0
+        self._text = None
+        list.__init__(self)
+
+    @property
+    def attr(self):
+        if self._attr is None:
+            self._attr = Attribute()
+            self._attr._index = self._index
+        return self._attr
+
+    @attr.setter
+    def attr(self, attr):
+        self._changed()
+        self._attr = attr
 
     __repr__ = object.__repr__
 
+    def _changed(self):
+        if self._index is not None:
+            self._index.valid = False
+
+    def append(self, item):
+        self._changed()
+        list.append(self, item)
+
+    def extend(self, items):
+        self._changed()
+        list.extend(self, items)
+
+    def insert(self, index, item):
+        self._changed()
+        list.insert(self, index, item)
+
+    def pop(self, *args):
+        self._changed()
+        return list.pop(self, *args)
+
+    def reverse(self):
+        self._changed()
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._changed()
+        list.sort(self, *args, **kwargs)
+
+    def __setitem__(self, index, item):
+        self._changed()
+        list.__setitem__(self, index, item)
+
+    def __delitem__(self, index):
+        self._changed()
+        list.__delitem__(self, index)
+
+    def __iadd__(self, items):
+        self._changed()
+        return list.__iadd__(self, items)
+
+    def __setslice__(self, i, j, items):
+        self._changed()
+        list.__setslice__(self, i, j, items)
+
+    def __delslice__(self, i, j):
+        self._changed()
+        list.__delslice__(self, i, j)
+
     def __str__(self):
         """
         This str function returns a string representation of the structure.
         """
 
-        html = ''
+        parts = []
+        self._write(parts)
+        return ''.join(parts)
 
+    def _write(self, parts):
+        # Tags write their children in the same buffer, other nodes are leaves
         for ind in self:
-            html = '%s%s' % (html, ind)
+            if isinstance(ind, Tag):
+                ind._write(parts)
+            else:
+                parts.append(ind.__str__())
 
-        return html
+    def _collect(self, parts):
+        for ind in self:
+            if ind.name == DATA:
+                parts.append(ind._data)
+            else:
+                ind._collect(parts)
 
     def __call__(self, tag=None, order=1, select=None, attribute='text', divider=('', 1)):
         """
@@ -137,19 +296,7 @@ class Root(list):
                 if isinstance(select, tuple):
                     select = [select]
                 values_tag = self.find(tag) if select is None else self.find(tag, 1, 1, *select)
-                value_tag = None
-                list_value_tag = list()
-                for item_tag in values_tag:
-                    list_value_tag.append(item_tag)
-
-                if order <= len(list_value_tag):
-                    try:
-                        value_tag = list_value_tag[order - 1]
-
-                    except IndexError:
-                        pass
-
-                value_tag = value_tag if value_tag is not None else None
+                value_tag = self._nth(values_tag, order)
             else:
                 value_tag = self
             if value_tag is not None:
@@ -171,6 +318,20 @@ class Root(list):
                 return ''
         return value_attrib
 
+    @staticmethod
+    def _nth(values_tag, order):
+        # Only the first order matches are looked at, unless counting from the end
+        if order >= 1:
+            return next(islice(values_tag, order - 1, None), None)
+
+        list_value_tag = list(values_tag)
+        if order <= len(list_value_tag):
+            try:
+                return list_value_tag[order - 1]
+            except IndexError:
+                pass
+        return None
+
     def sail(self):
         """
         This is used to navigate through the xml/html document.
@@ -293,7 +454,10 @@ class Root(list):
         <p style="color:green" > beta.</p>
         """
         cm = 0
-        for ind in self.sail():
+        candidates = self._index.find(self, name, args) if self._index is not None else None
+        if candidates is None:
+            candidates = self.sail()
+        for ind in candidates:
             if ind.name == name:
                 for key, values in args:
                     results = []
@@ -318,19 +482,9 @@ class Root(list):
             select = [select]
         if self is not None and tag is not None:
             values_tag = self.find(tag) if select is None else self.find(tag, 1, 1, *select)
-            value_tag = Tag('html')
-            list_value_tag = list()
-            for item_tag in values_tag:
-                list_value_tag.append(item_tag)
-
-            if order <= len(list_value_tag):
-                try:
-                    value_tag = list_value_tag[order - 1]
-
-                except IndexError:
-                    pass
-
-            value_tag = value_tag if value_tag is not None else None
+            value_tag = self._nth(values_tag, order)
+            if value_tag is None:
+                value_tag = Tag('html')
         return value_tag
 
     def find_all(self, tag=None, select=None, every=1, start=1):
@@ -542,13 +696,14 @@ class Root(list):
         gamma
         """
 
-        data = ''
+        parts = []
 
         for ind in self.sail():
             if ind.name in args:
-                data = '%s%s%s' % (data, delim, ind)
+                parts.append(delim)
+                parts.append(ind.__str__())
 
-        return data
+        return ''.join(parts)
 
     def fst(self, name, *args):
         """
@@ -664,7 +819,16 @@ class Root(list):
         children then it returns all the *printable* characters
         for that node.
         """
-        return self.join('', DATA)
+        # Text of parsed nodes is cached until the tree is changed, see Index
+        if self._text is not None and self._index.valid:
+            return self._text
+
+        parts = []
+        self._collect(parts)
+        text = ''.join(parts)
+        if self._index is not None and self._index.valid:
+            self._text = text
+        return text
 
     def write(self, filename):
         """
@@ -814,6 +978,8 @@ class Tag(Root):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, name, attr=None):
         """
         The parameter name is the xml/html tag's name.
@@ -832,14 +998,12 @@ class Tag(Root):
         This function returns a string representation for a node.
         """
 
-        html = '<%s %s>' % (self.name, self.attr)
+        return Root.__str__(self)
 
-        for ind in self:
-            html = '%s%s' % (html, ind)
-
-        html += '</%s>' % self.name
-
-        return html
+    def _write(self, parts):
+        parts.append('<%s %s>' % (self.name, self._attr or ''))
+        Root._write(self, parts)
+        parts.append('</%s>' % self.name)
 
 
 class Data(Root):
@@ -872,6 +1036,8 @@ class Data(Root):
     up the structure identically to the document.
     """
 
+    __slots__ = ('_data',)
+
     def __init__(self, data):
         """
         The data holds the characters.
@@ -891,7 +1057,7 @@ class Data(Root):
         """
 
         Root.__init__(self, DATA)
-        self.data = data
+        self._data = data
 
     def __str__(self):
         """
@@ -899,10 +1065,22 @@ class Data(Root):
         Data class.
         """
 
-        return self.data
+        return self._data
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._changed()
+        self._data = data
 
     def text(self):
-        return self.data
+        return self._data
+
+    def _collect(self, parts):
+        parts.append(self._data)
 
 
 class XTag(Root):
@@ -912,6 +1090,8 @@ class XTag(Root):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, name, attr=None):
         """
         See help(Tag).
@@ -921,7 +1101,7 @@ class XTag(Root):
         Root.__init__(self, name, attr)
 
     def __str__(self):
-        html = '<%s %s/>' % (self.name, self.attr)
+        html = '<%s %s/>' % (self.name, self._attr or '')
 
         return html
 
@@ -931,6 +1111,8 @@ class Meta(Root):
 
     """
 
+    __slots__ = ('data',)
+
     def __init__(self, data):
         Root.__init__(self, META)
         self.data = data
@@ -945,6 +1127,8 @@ class Code(Root):
     """
     """
 
+    __slots__ = ('data',)
+
     def __init__(self, data):
         Root.__init__(self, CODE)
         self.data = data
@@ -960,6 +1144,8 @@ class Amp(Root):
 
     """
 
+    __slots__ = ('data',)
+
     def __init__(self, data):
         Root.__init__(self, AMP)
         self.data = data
@@ -975,6 +1161,8 @@ class Pi(Root):
 
     """
 
+    __slots__ = ('data',)
+
     def __init__(self, data):
         Root.__init__(self, PI)
         self.data = data
@@ -990,6 +1178,8 @@ class Comment(Root):
 
     """
 
+    __slots__ = ('data',)
+
     def __init__(self, data):
         Root.__init__(self, COMMENT)
         self.data = data
@@ -1011,20 +1201,57 @@ class Tree(object):
         hold all data inside the file.
         """
 
-        self.outmost = Root('')
-
         self.stack = deque()
-        self.stack.append(self.outmost)
+        self.clear()
 
     def clear(self):
         """
         Clear the outmost and stack for a new parsing.
         """
 
+        self.index = Index()
+        self.count = 0
         self.outmost = Root('')
+        self.open(self.outmost)
         self.stack.clear()
         self.stack.append(self.outmost)
 
+    def open(self, item):
+        """
+        Numbers a node whose children are about to be parsed.
+        """
+
+        item._index = self.index
+        if item._attr is not None:
+            item._attr._index = self.index
+        item._first = self.count
+
+    def close(self, item):
+        """
+        Numbers a node once all its children are parsed and indexes it.
+        """
+
+        item._post = self.count
+        self.count += 1
+        self.index.add(item)
+
+    def leaf(self, top, item):
+        """
+        Appends a node without children to top.
+        """
+
+        self.open(item)
+        self.close(item)
+        list.append(top, item)
+
+    def finish(self):
+        """
+        Closes the tags left open at the end of the document.
+        """
+
+        while self.stack:
+            self.close(self.stack.pop())
+
     def last(self):
         """
         Return the last pointer which point to the actual tag scope.
@@ -1039,12 +1266,9 @@ class Tree(object):
         """
 
         item = Tag(name, attr)
+        self.open(item)
 
-        pointer = self.stack.pop()
-
-        pointer.append(item)
-
-        self.stack.append(pointer)
+        list.append(self.stack[-1], item)
 
         self.stack.append(item)
 
@@ -1057,7 +1281,7 @@ class Tree(object):
 
         item = Data(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def xnest(self, name, attr):
         """
@@ -1068,7 +1292,7 @@ class Tree(object):
 
         item = XTag(name, attr)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def ynest(self, data):
         """
@@ -1079,7 +1303,7 @@ class Tree(object):
 
         item = Meta(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def mnest(self, data):
         """
@@ -1090,7 +1314,7 @@ class Tree(object):
 
         item = Comment(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def cnest(self, data):
         """
@@ -1101,7 +1325,7 @@ class Tree(object):
 
         item = Code(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def rnest(self, data):
         """
@@ -1112,7 +1336,7 @@ class Tree(object):
 
         item = Amp(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def inest(self, data):
         """
@@ -1123,7 +1347,7 @@ class Tree(object):
 
         item = Pi(data)
 
-        top.append(item)
+        self.leaf(top, item)
 
     def enclose(self, name):
         """
@@ -1143,7 +1367,139 @@ class Tree(object):
 
         # It pops all the items which do not match with the closing tag.
         for i in xrange(0, count):
-            self.stack.pop()
+            self.close(self.stack.pop())
+
+
+class RowTree(Tree):
+    """
+    Builds only the subtrees of rows, as matched by Root.find_all, optionally
+    below the node Root.find_once would return, see Html.rows.
+
+    The other nodes are not attached to any parent and are discarded once closed.
+    Rows are numbered and indexed as usual, sharing an Index until they're yielded
+    or discarded.
+    """
+
+    def __init__(self, row, container=None):
+        """
+        The row is (tag, select, every, start) and the container (tag, select, order),
+        select being None or a single (key, values) pair.
+        """
+
+        self.row = row
+        self.container = container
+        Tree.__init__(self)
+
+    def clear(self):
+        """
+        Clear the state for a new parsing.
+        """
+
+        # Only rows are numbered and indexed
+        self.index = None
+        self.count = 0
+        self.outmost = Root('')
+        self.stack.clear()
+        self.stack.append(self.outmost)
+
+        self.ready = deque()
+        self.done = False
+        self.open_rows = []
+        self.rows = []
+        self.containers = []
+        self.found = 0
+        self.matched = 0
+
+    @staticmethod
+    def matches(item, name, select):
+        """
+        Same test as Root.find for one node.
+        """
+
+        if item.name != name:
+            return False
+        if select is None:
+            return True
+        key, values = select
+        tokens = item.attr[key].split() if item._attr else []
+        for value in (values if isinstance(values, list) else [values]):
+            if value in tokens:
+                return True
+        return False
+
+    def select(self, rows):
+        """
+        Applies every and start to rows in sail() order.
+        """
+
+        every, start = self.row[2], self.row[3]
+        for item in rows:
+            self.matched += 1
+            if self.matched >= start and (self.matched - start) % every == 0:
+                self.ready.append(item)
+
+    def start(self, item):
+        if self.done:
+            return
+
+        is_row = self.matches(item, self.row[0], self.row[1]) and (self.container is None or self.containers)
+        if self.open_rows:
+            list.append(self.stack[-1], item)
+            self.open(item)
+        elif is_row:
+            if self.index is None:
+                self.index = Index()
+                self.count = 0
+            self.open(item)
+
+        if is_row:
+            self.open_rows.append(item)
+        if self.container is not None and self.matches(item, self.container[0], self.container[1]):
+            self.containers.append((item, len(self.rows)))
+
+    def close(self, item):
+        if item._index is not None:
+            Tree.close(self, item)
+        if self.done:
+            return
+
+        # A container is not below itself, so it's done before it counts as a row
+        if self.containers and self.containers[-1][0] is item:
+            mark = self.containers.pop()[1]
+            self.found += 1
+            if self.found == self.container[2]:
+                self.select(self.rows[mark:])
+                self.done = True
+            elif not self.containers:
+                del self.rows[:]
+                self.index = None
+
+        if self.open_rows and self.open_rows[-1] is item:
+            self.open_rows.pop()
+            if self.container is None:
+                if not self.open_rows:
+                    self.index = None
+                self.select([item])
+            elif self.containers:
+                self.rows.append(item)
+
+    def nest(self, name, attr):
+        """
+        Nest a given tag if it's in a row, or starts one.
+        """
+
+        item = Tag(name, attr)
+        self.start(item)
+        self.stack.append(item)
+
+    def leaf(self, top, item):
+        """
+        Appends a node without children if it's in a row, or is one.
+        """
+
+        if self.open_rows or not isinstance(item.name, int):
+            self.start(item)
+            self.close(item)
 
 
 class Html(HTMLParser):
@@ -1175,9 +1531,39 @@ class Html(HTMLParser):
             return None
         self.structure.clear()
         HTMLParser.feed(self, data)
+        self.structure.finish()
 
         return self.structure.outmost
 
+    def rows(self, data, row, container=None, size=16384):
+        """
+        Streams the rows of a document without building its whole tree, rows are
+        yielded as soon as they're known to match.
+
+        rows(data, ('tr', None, 1, 2), ('table', ('class', 'forumline'), 1)) yields
+        the same nodes as dom.find_once('table', ('class', 'forumline'), order=1).find_all('tr', start=2)
+
+        The document is fed in chunks of size characters, so rows come out while it's
+        parsed, and parsing stops once the container is closed.
+        """
+
+        if not data:
+            return
+        structure = self.structure
+        self.structure = tree = RowTree(row, container)
+        try:
+            for i in xrange(0, len(data), size):
+                HTMLParser.feed(self, data[i:i + size])
+                while tree.ready:
+                    yield tree.ready.popleft()
+                if tree.done:
+                    return
+            tree.finish()
+            while tree.ready:
+                yield tree.ready.popleft()
+        finally:
+            self.structure = structure
+
     def handle_starttag(self, name, attr):
         """
         When found an opening tag then nest it onto the tree
@@ -1246,3 +1632,171 @@ class Html(HTMLParser):
         """
 
         self.structure.mnest(data)
+
+
+# Plain tags FastHtml tokenizes by itself: ASCII names, whitespace and unquoted values,
+# all of them are tokenized by HTMLParser into the same tag and attributes.
+_space = '[ \t\n\r\f]'
+_name = '[a-zA-Z][-.a-zA-Z0-9:_]*'
+_value = '"[^"]*"|\'[^\']*\'|[!#-&(-;?-_a-~]+'
+plain_starttag = re.compile(r'<(%s)((?:%s+[a-zA-Z_:][-.a-zA-Z0-9:_]*(?:%s*=%s*(?:%s))?)*)%s*(/?)>' % (
+    _name, _space, _space, _space, _value, _space))
+plain_attribute = re.compile(r'([a-zA-Z_:][-.a-zA-Z0-9:_]*)(?:%s*=%s*(%s))?' % (_space, _space, _value))
+plain_endtag = re.compile(r'</(%s)%s*>' % (_name, _space))
+
+
+class FastHtml(Html):
+    """
+    Html with a faster tokenizer, building the identical tree.
+
+    Plain start and end tags are matched with a single regex each, anything
+    else goes through HTMLParser. Line and column numbers, only used in
+    error messages, are not tracked.
+    """
+
+    def updatepos(self, i, j):
+        return j
+
+    def goahead(self, end):
+        # Same as HTMLParser.goahead, with plain tags handled inline
+        rawdata = self.rawdata
+        i = 0
+        n = len(rawdata)
+        handle_data = self.handle_data
+        while i < n:
+            match = self.interesting.search(rawdata, i)  # < or &
+            if match:
+                j = match.start()
+            else:
+                if self.cdata_elem:
+                    break
+                j = n
+            if i < j:
+                handle_data(rawdata[i:j])
+            i = j
+            if i == n:
+                break
+            startswith = rawdata.startswith
+            if startswith('<', i):
+                if self.cdata_elem is None:
+                    match = plain_starttag.match(rawdata, i) or plain_endtag.match(rawdata, i)
+                    if match is not None:
+                        i = self.plain_tag(match)
+                        continue
+                if starttagopen.match(rawdata, i):  # < + letter
+                    k = Html.parse_starttag(self, i)
+                elif startswith("</", i):
+                    k = Html.parse_endtag(self, i)
+                elif startswith("<!--", i):
+                    k = self.parse_comment(i)
+                elif startswith("<?", i):
+                    k = self.parse_pi(i)
+                elif startswith("<!", i):
+                    k = self.parse_html_declaration(i)
+                elif (i + 1) < n:
+                    handle_data("<")
+                    k = i + 1
+                else:
+                    break
+                if k < 0:
+                    if not end:
+                        break
+                    k = rawdata.find('>', i + 1)
+                    if k < 0:
+                        k = rawdata.find('<', i + 1)
+                        if k < 0:
+                            k = i + 1
+                    else:
+                        k += 1
+                    handle_data(rawdata[i:k])
+                i = k
+            elif startswith("&#", i):
+                match = charref.match(rawdata, i)
+                if match:
+                    name = match.group()[2:-1]
+                    self.handle_charref(name)
+                    k = match.end()
+                    if not startswith(';', k-1):
+                        k = k - 1
+                    i = k
+                    continue
+                else:
+                    if ";" in rawdata[i:]:  # bail by consuming '&#'
+                        handle_data(rawdata[i:i+2])
+                        i = i + 2
+                    break
+            elif startswith('&', i):
+                match = entityref.match(rawdata, i)
+                if match:
+                    name = match.group(1)
+                    self.handle_entityref(name)
+                    k = match.end()
+                    if not startswith(';', k-1):
+                        k = k - 1
+                    i = k
+                    continue
+                match = incomplete.match(rawdata, i)
+                if match:
+                    # match.group() will contain at least 2 chars
+                    if end and match.group() == rawdata[i:]:
+                        self.error("EOF in middle of entity or char ref")
+                    # incomplete
+                    break
+                elif (i + 1) < n:
+                    # not the end of the buffer, and can't be confused
+                    # with some other construct
+                    handle_data("&")
+                    i = i + 1
+                else:
+                    break
+            else:
+                assert 0, "interesting.search() lied"
+        # end while
+        if end and i < n and not self.cdata_elem:
+            handle_data(rawdata[i:n])
+            i = n
+        self.rawdata = rawdata[i:]
+
+    def plain_tag(self, match):
+        if match.re is plain_endtag:
+            self.handle_endtag(match.group(1).lower())
+            return match.end()
+
+        self.lasttag = tag = match.group(1).lower()
+        attrs = []
+        if match.group(2):
+            for attrname, attrvalue in plain_attribute.findall(match.group(2)):
+                if not attrvalue:
+                    attrvalue = None
+                elif attrvalue[:1] == '\'' or attrvalue[:1] == '"':
+                    attrvalue = attrvalue[1:-1]
+                if attrvalue:
+                    attrvalue = self.unescape(attrvalue)
+                attrs.append((attrname.lower(), attrvalue))
+
+        if match.group(3):
+            self.handle_startendtag(tag, attrs)
+        else:
+            self.handle_starttag(tag, attrs)
+            if tag in self.CDATA_CONTENT_ELEMENTS:
+                self.set_cdata_mode(tag)
+        return match.end()
+
+
+# Tokenizers able to build ehp trees, by name
+BACKENDS = {
+    'vendored': Html,
+    'fast': FastHtml,
+}
+DEFAULT_BACKEND = 'fast'
+
+
+def parser(backend=None):
+    """
+    Returns a new parser for the named backend, falling back to the default
+    backend when the name is unknown.
+
+    dom = parser('vendored').feed(data)
+    """
+
+    return BACKENDS.get(backend, BACKENDS[DEFAULT_BACKEND])()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova bounded worker pool
+"""
+
+from future.utils import PY3
+
+import itertools
+from threading import Thread, Lock, Event, BoundedSemaphore
+from elementum.provider import log
+if PY3:
+    from queue import PriorityQueue, Empty
+else:
+    from Queue import PriorityQueue, Empty
+
+# Task priorities, lower values are picked up first
+PRIORITY_PROVIDER = 0
+PRIORITY_SUBPAGE = 10
+
+# Simultaneous requests allowed to the same host
+HOST_LIMIT = 4
+
+
+class Task:
+    """ A unit of work submitted to a ``Pool``
+
+    Attributes:
+        result: Value returned by the target, ``None`` until done
+        error (Exception): Exception raised by the target, if any
+    """
+    def __init__(self, pool, host, target, args):
+        self.pool = pool
+        self.host = host
+        self.target = target
+        self.args = args
+        self.result = None
+        self.error = None
+        self._claimed = False
+        self._done = Event()
+
+    def claim(self):
+        """ Marks the task as started, returns ``False`` if somebody else already did
+        """
+        with self.pool.lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def run(self):
+        """ Runs the target, respecting the per-host limit
+        """
+        semaphore = self.pool.host_semaphore(self.host)
+        if semaphore:
+            semaphore.acquire()
+        try:
+            self.result = self.target(*self.args)
+        except Exception as e:
+            import traceback
+            self.error = e
+            log.error("Pool task %s failed with: %s" % (repr(self.target), repr(e)))
+            for line in traceback.format_exc().split("\n"):
+                log.debug(line)
+        finally:
+            if semaphore:
+                semaphore.release()
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ Waits for the task to finish
+
+        If no worker picked the task up yet, it is executed in the calling thread,
+        so tasks waiting on other tasks can never exhaust the pool.
+
+        Args:
+            timeout (float): Maximum seconds to wait for a task already running elsewhere
+
+        Returns:
+            bool: Whether the task has finished
+        """
+        if self.claim():
+            self.run()
+        return self._done.wait(timeout)
+
+
+class Pool:
+    """ Search-scoped pool with a bounded number of worker threads
+
+    Args:
+        workers  (int): Maximum number of worker threads
+        per_host (int): Maximum simultaneous tasks for a single host
+    """
+    def __init__(self, workers, per_host=HOST_LIMIT):
+        self.workers = max(1, workers)
+        self.per_host = per_host
+        self.lock = Lock()
+        self._queue = PriorityQueue()
+        self._counter = itertools.count()
+        self._hosts = {}
+        self._threads = []
+        self._closed = False
+
+    def host_semaphore(self, host):
+        if not host or not self.per_host:
+            return None
+        with self.lock:
+            if host not in self._hosts:
+                self._hosts[host] = BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def submit(self, priority, host, target, *args):
+        """ Queues ``target(*args)`` for execution
+
+        Args:
+            priority (int): Task priority, see ``PRIORITY_*``
+            host     (str): Host the task talks to, used for per-host limits, or ``None``
+            target (function): Callable to execute
+
+        Returns:
+            Task: The queued task
+        """
+        task = Task(self, host, target, args)
+        with self.lock:
+            if self._closed:
+                # Search is over, nobody is going to use the result
+                task._claimed = True
+                task._done.set()
+                return task
+            self._queue.put((priority, next(self._counter), task))
+            if len(self._threads) < self.workers:
+                worker = Thread(target=self._work)
+                # Workers blocked on the queue must never keep the interpreter alive
+                worker.daemon = True
+                self._threads.append(worker)
+                worker.start()
+        return task
+
+    def _work(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                break
+            if task.claim():
+                task.run()
+
+    def shutdown(self):
+        """ Stops the workers once the running tasks finish, pending tasks are dropped
+        """
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            while True:
+                try:
+                    _, _, task = self._queue.get_nowait()
+                except Empty:
+                    break
+                if task is not None and not task._claimed:
+                    task._claimed = True
+                    task._done.set()
+            for _ in self._threads:
+                self._queue.put((float('inf'), next(self._counter), None))
@@ -9,9 +9,11 @@ from future.utils import PY3, iteritems
 import os
 import re
 import time
+from . import telemetry
 from .client import Client
-from elementum.provider import log, get_setting
-from .providers.definitions import definitions, longest
+from elementum.provider import log
+from .settings import get_setting
+from .providers.definitions import definitions, longest, compile_expression
 from .utils import ADDON_PATH, get_int, clean_size, get_alias, notify, translation, get_icon_path
 from kodi_six import xbmc, xbmcaddon, py2_encode
 from .providers.helpers import fix_lf
@@ -41,28 +43,36 @@ def generate_payload(provider, generator, filtering, verify_name=True, verify_si
 
     definition = definitions[provider]
     definition = get_alias(definition, get_setting("%s_alias" % provider))
+    sort_by_resolution = get_setting("sort_by_resolution", bool)
 
+    rows = []
+    candidates = []
     for name, info_hash, uri, size, seeds, peers in generator:
         size = clean_size(size)
-        v_name = name if verify_name else filtering.title
-        v_size = size if verify_size else None
-        if filtering.verify(provider, v_name, v_size):
-            item = {
-                "name": name,
-                "uri": uri,
-                "info_hash": info_hash,
-                "size": size,
-                "seeds": get_int(seeds),
-                "peers": get_int(peers),
-                "language": definition["language"] if 'language' in definition else 'en',
-                "provider": '[COLOR %s]%s[/COLOR]' % (definition['color'], definition['name']),
-                "icon": os.path.join(ADDON_PATH, 'nova', 'providers', 'icons', '%s.png' % provider),
-            }
-            if (get_setting("sort_by_resolution", bool)):
-                item.update({"resolution": get_int(filtering.determine_resolution(v_name)[7:-1])})
-            results.append(item)
-        else:
-            log.debug(filtering.reason)
+        rows.append((name, info_hash, uri, size, seeds, peers))
+        candidates.append((name if verify_name else filtering.title, size if verify_size else None))
+
+    accepted, rejected = filtering.verify_batch(provider, candidates)
+    telemetry.count(provider, len(rows), len(accepted), rejected)
+    for _, rejection in rejected:
+        log.debug(rejection)
+
+    for index, release in accepted:
+        name, info_hash, uri, size, seeds, peers = rows[index]
+        item = {
+            "name": name,
+            "uri": uri,
+            "info_hash": info_hash,
+            "size": size,
+            "seeds": get_int(seeds),
+            "peers": get_int(peers),
+            "language": definition["language"] if 'language' in definition else 'en',
+            "provider": '[COLOR %s]%s[/COLOR]' % (definition['color'], definition['name']),
+            "icon": os.path.join(ADDON_PATH, 'nova', 'providers', 'icons', '%s.png' % provider),
+        }
+        if sort_by_resolution:
+            item.update({"resolution": release.height})
+        results.append(item)
 
     log.debug('[%s] >>>>>> %s would send %d torrents to Elementum <<<<<<<' % (provider, provider, len(results)))
 
@@ -138,7 +148,7 @@ def process(provider, generator, filtering, has_special, verify_name=True, verif
         url_search = url_search.replace('%20', definition['separator'])
 
         if 'post_data' in definition and not filtering.post_data:
-            filtering.post_data = eval(definition['post_data'])
+            filtering.post_data = eval(compile_expression(definition['post_data']))
 
         # Creating the payload for POST method
         payload = dict()
@@ -178,7 +188,8 @@ def process(provider, generator, filtering, has_special, verify_name=True, verif
             if 'login_object' in definition and definition['login_object']:
                 logged_in = False
                 try:
-                    login_object = definition['login_object'].replace('USERNAME', '"%s"' % username).replace('PASSWORD', '"%s"' % password)
+                    # USERNAME and PASSWORD are names in the expression, so credentials never need quoting
+                    login_object = eval(compile_expression(definition['login_object']), {'USERNAME': username, 'PASSWORD': password})
                 except Exception as e:
                     log.error("[{0}] Make login_object fail: {1}".format(provider, e))
                     return filtering.results
@@ -192,7 +203,7 @@ def process(provider, generator, filtering, has_special, verify_name=True, verif
                         log.info('[%s] Login successful' % provider)
                         logged_in = True
 
-                if not logged_in and client.login(definition['root_url'] + definition['login_path'], eval(login_object), definition['login_failed']):
+                if not logged_in and client.login(definition['root_url'] + definition['login_path'], login_object, definition['login_failed']):
                     log.info('[%s] Login successful' % provider)
                     logged_in = True
                 elif not logged_in:
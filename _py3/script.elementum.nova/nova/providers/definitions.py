@@ -7,8 +7,10 @@ from future.utils import PY3, iteritems
 
 import os
 import sys
+import ast
 import json
 import time
+import __future__
 import collections
 from glob import glob
 if PY3:
@@ -28,6 +30,12 @@ if not ADDON_PATH:
     ADDON_PATH = ".."
 
 definitions = {}
+compiled = {}
+row_plans = {}
+
+PARSER_KEYS = ['row', 'name', 'torrent', 'size', 'seeds', 'peers', 'infohash']
+# Parser expressions were evaluated from nova.nova, which uses unicode literals
+PARSER_FLAGS = __future__.unicode_literals.compiler_flag
 
 
 def load_providers(path, custom=False, fix_seasons=False):
@@ -121,6 +129,125 @@ def update(d, u):
     return d
 
 
+def compile_expression(source, flags=0):
+    """ Compiles a definition expression, code objects are cached by source
+
+    Args:
+        source (str): Python expression
+        flags  (int): Compiler flags, ie. ``PARSER_FLAGS``
+
+    Returns:
+        code: Compiled expression, to be run with ``eval``
+
+    Raises:
+        SyntaxError: When the expression is invalid
+    """
+    key = (source, flags)
+    code = compiled.get(key)
+    if code is None:
+        code = compile(source, '<definition>', 'eval', flags, True)
+        compiled[key] = code
+    return code
+
+
+def parser_expression(definition, key):
+    """ Compiled parser expression of a definition
+
+    Args:
+        definition (dict): Provider definition, possibly with an alias applied
+        key         (str): Parser key, one of ``PARSER_KEYS``
+
+    Returns:
+        code: Compiled expression, ``row`` is evaluated against ``dom`` and the others against ``item``,
+            or ``None`` if the definition doesn't have this expression
+    """
+    source = definition['parser'].get(key)
+    if not source:
+        return None
+    if key == 'row':
+        source = 'dom.' + source
+    return compile_expression(source, PARSER_FLAGS)
+
+
+def _call_arguments(call, names, defaults):
+    if getattr(call, 'starargs', None) or getattr(call, 'kwargs', None) or len(call.args) > len(names):
+        raise ValueError("Unsupported arguments")
+    values = dict(zip(names, defaults))
+    for name, arg in zip(names, call.args):
+        values[name] = ast.literal_eval(arg)
+    for keyword in call.keywords:
+        if keyword.arg not in names:
+            raise ValueError("Unsupported argument %s" % keyword.arg)
+        values[keyword.arg] = ast.literal_eval(keyword.value)
+    return values
+
+
+def _single_select(select):
+    if select is None or isinstance(select, tuple):
+        return select
+    if isinstance(select, list) and len(select) == 1 and isinstance(select[0], tuple):
+        return select[0]
+    raise ValueError("Unsupported select")
+
+
+def _plan_row(source):
+    expression = ast.parse(source, mode='eval').body
+    if not isinstance(expression, ast.Call) or not isinstance(expression.func, ast.Attribute) \
+            or expression.func.attr != 'find_all':
+        return None
+    row = _call_arguments(expression, ['tag', 'select', 'every', 'start'], [None, None, 1, 1])
+    container = None
+    parent = expression.func.value
+    if isinstance(parent, ast.Call) and isinstance(parent.func, ast.Attribute) and parent.func.attr == 'find_once':
+        container = _call_arguments(parent, ['tag', 'select', 'order'], [None, None, 1])
+        parent = parent.func.value
+        if not container['tag'] or container['order'] < 1:
+            return None
+        container = (container['tag'], _single_select(container['select']), container['order'])
+    if not isinstance(parent, ast.Name) or parent.id != 'dom' or not row['tag'] or row['every'] < 1:
+        return None
+    return (row['tag'], _single_select(row['select']), row['every'], row['start']), container
+
+
+def row_plan(definition):
+    """ Row expression of a definition as arguments for ``Html.rows``
+
+    Only ``find_all(...)`` and ``find_once(...).find_all(...)`` expressions with literal
+    arguments and a single attribute selection can be streamed.
+
+    Args:
+        definition (dict): Provider definition, possibly with an alias applied
+
+    Returns:
+        tuple: Row and container arguments, or ``None`` if the expression can't be streamed
+    """
+    source = 'dom.' + definition['parser']['row']
+    if source not in row_plans:
+        try:
+            row_plans[source] = _plan_row(source)
+        except (SyntaxError, ValueError, TypeError):
+            row_plans[source] = None
+    return row_plans[source]
+
+
+def compile_definitions():
+    """ Compiles and validates expressions of all loaded definitions
+
+    Providers with invalid expressions are disabled instead of failing mid-search.
+    """
+    for provider, definition in iteritems(definitions):
+        try:
+            if 'parser' in definition and not definition.get('is_api'):
+                for key in PARSER_KEYS:
+                    parser_expression(definition, key)
+            for key in ['post_data', 'login_object']:
+                if definition.get(key):
+                    compile_expression(definition[key])
+        except SyntaxError as e:
+            log.error("[%s] Invalid definition expression, disabling provider: %s", provider, repr(e))
+            definition['enabled'] = False
+
+
 # Load providers
 load_providers(os.path.join(ADDON_PATH, 'nova', 'providers', 'providers.json'), fix_seasons=True)
 
@@ -144,6 +271,8 @@ custom_overrides = xbmc.translatePath(ADDON_PROFILE)
 if os.path.exists(os.path.join(custom_overrides, 'overrides.py')):
     load_overrides(custom_overrides, custom=True)
 
+compile_definitions()
+
 longest = 10
 if len(definitions) > 0:
     longest = len(definitions[sorted(definitions, key=lambda p: len(definitions[p]['name']), reverse=True)[0]]['name'])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova per-search settings snapshot
+"""
+
+from threading import RLock
+from elementum.provider import get_setting as read_setting
+
+current = None
+
+
+class Settings:
+    """
+    Read-only snapshot of the addon settings for one search, shared by all its providers
+
+    Each setting is read from Kodi the first time a search needs it and never again,
+    so settings changed while searching only apply to the next search. Values built
+    from settings, like the compiled filters, are also built once and shared.
+    """
+    def __init__(self):
+        self._values = {}
+        self._derived = {}
+        self._lock = RLock()
+
+    def get(self, key, converter=str, choices=None):
+        """ Setting value, same as ``elementum.provider.get_setting``
+        """
+        cache_key = (key, converter, choices)
+        with self._lock:
+            if cache_key not in self._values:
+                self._values[cache_key] = read_setting(key, converter, choices)
+            return self._values[cache_key]
+
+    def derived(self, name, build):
+        """ Value built from settings, only once for the whole search
+
+        Args:
+            name       (str): Name of the value
+            build (function): Builds the value, reading settings with ``get_setting``
+
+        Returns:
+            The built value, which must not be modified as it's shared between providers
+        """
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = build()
+            return self._derived[name]
+
+
+def snapshot():
+    """ Starts a new settings snapshot, used by everything of the search from now on
+
+    Returns:
+        Settings: The new snapshot
+    """
+    global current
+    current = Settings()
+    return current
+
+
+def get_setting(key, converter=str, choices=None):
+    """ Setting value from the current search's snapshot, or from Kodi outside of a search
+    """
+    if current is None:
+        return read_setting(key, converter, choices)
+    return current.get(key, converter, choices)
+
+
+def derived(name, build):
+    """ Value built from settings, shared for the whole search, see ``Settings.derived``
+    """
+    if current is None:
+        return build()
+    return current.derived(name, build)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova per-provider latency statistics
+"""
+
+import os
+import json
+import time
+from io import open
+from threading import Lock
+from elementum.provider import log
+from kodi_six import xbmc
+from .utils import ADDON_PROFILE, file_lock
+
+STATS_FILE = os.path.join(xbmc.translatePath(ADDON_PROFILE), 'provider_stats.json')
+MAX_SAMPLES = 50  # Only the most recent runs are kept for each provider
+MIN_SAMPLES = 5   # Runs needed before statistics are trusted for scheduling
+RETRY_AFTER = 86400  # Skipped providers are probed again after a day
+
+stats = None
+pending = {}  # Runs recorded since the statistics were loaded or saved
+running = {}
+lock = Lock()
+
+
+def read_stats():
+    if not os.path.exists(STATS_FILE):
+        return {}
+    try:
+        with open(STATS_FILE, encoding='utf-8') as file:
+            return json.load(file)
+    except Exception as e:
+        log.debug("Reading provider stats error: %s" % repr(e))
+        return {}
+
+
+def load_stats():
+    """ Loads saved statistics from the addon profile, only once per interpreter
+    """
+    global stats
+    if stats is not None:
+        return
+    stats = read_stats()
+
+
+def save_stats():
+    """ Saves statistics to the addon profile
+
+    Runs recorded by other processes meanwhile are kept, the runs recorded here
+    are added to them, and the file is replaced atomically so readers never see
+    a partial write.
+    """
+    global stats
+    temp = '%s.%d.tmp' % (STATS_FILE, os.getpid())
+    with lock:
+        if not pending:
+            return
+        try:
+            with file_lock(STATS_FILE):
+                saved = read_stats()
+                for provider, runs in pending.items():
+                    for duration, failed, updated in runs:
+                        add_sample(saved, provider, duration, failed, updated)
+                with open(temp, 'w', encoding='utf-8') as file:
+                    file.write(u'%s' % json.dumps(saved))
+                try:
+                    os.rename(temp, STATS_FILE)
+                except OSError:
+                    # Windows doesn't replace existing files on rename
+                    os.remove(STATS_FILE)
+                    os.rename(temp, STATS_FILE)
+            stats = saved
+            pending.clear()
+        except Exception as e:
+            log.debug("Saving provider stats error: %s" % repr(e))
+
+
+def add_sample(data, provider, duration, failed, updated):
+    samples = data.setdefault(provider, {'times': [], 'failed': []})
+    samples['times'] = (samples['times'] + [duration])[-MAX_SAMPLES:]
+    samples['failed'] = (samples['failed'] + [failed])[-MAX_SAMPLES:]
+    samples['updated'] = max(samples.get('updated', 0), updated)
+
+
+def record(provider, duration, failed):
+    run = (round(duration, 2), 1 if failed else 0, int(time.time()))
+    add_sample(stats, provider, *run)
+    pending.setdefault(provider, []).append(run)
+
+
+def start(provider):
+    """ Marks a provider run as started
+    """
+    with lock:
+        running[provider] = time.time()
+
+
+def finish(provider, failed=False):
+    """ Records the duration of a provider run, unless it was already abandoned
+
+    Args:
+        provider (str): Provider ID
+        failed  (bool): Whether the provider run failed
+    """
+    with lock:
+        if provider in running:
+            record(provider, time.time() - running.pop(provider), failed)
+
+
+def abandon(failed=True):
+    """ Forgets all still running providers, used when the search is over
+
+    Args:
+        failed (bool): Whether to record them as failed runs, or not record them at all
+    """
+    with lock:
+        for provider in list(running):
+            started = running.pop(provider)
+            if failed:
+                record(provider, time.time() - started, True)
+
+
+def percentile(provider, value=95):
+    """ Latency percentile of a provider
+
+    Args:
+        provider (str): Provider ID
+        value    (int): Percentile to compute
+
+    Returns:
+        float: Latency in seconds, or ``None`` if there are not enough samples
+    """
+    times = sorted(stats.get(provider, {}).get('times', []))
+    if len(times) < MIN_SAMPLES:
+        return None
+    return times[min(len(times) - 1, int(len(times) * value / 100.0))]
+
+
+def failure_rate(provider):
+    failed = stats.get(provider, {}).get('failed', [])
+    if len(failed) < MIN_SAMPLES:
+        return 0.0
+    return float(sum(failed)) / len(failed)
+
+
+def schedule(providers, timeout, skip_slow=False):
+    """ Orders providers so historically slow ones start first and computes their deadlines
+
+    Providers whose p95 latency is beyond ``timeout`` are moved to the end,
+    or skipped entirely when ``skip_slow`` is enabled.
+
+    Args:
+        providers (list): Enabled provider IDs
+        timeout    (int): Search time budget in seconds
+        skip_slow (bool): Whether to skip providers that are too slow for the budget
+
+    Returns:
+        tuple: Ordered provider IDs, dictionary of per-provider deadlines in seconds, and skipped provider IDs
+    """
+    load_stats()
+    fast = []
+    slow = []
+    skipped = []
+    deadlines = {}
+    for provider in providers:
+        p95 = percentile(provider)
+        if p95 is None:
+            deadlines[provider] = timeout
+            fast.append((timeout, provider))
+        elif p95 > timeout or failure_rate(provider) > 0.5:
+            if skip_slow and time.time() - stats[provider].get('updated', 0) < RETRY_AFTER:
+                skipped.append(provider)
+            else:
+                deadlines[provider] = timeout
+                slow.append((p95, provider))
+        else:
+            # Give some headroom over the usual worst case
+            deadlines[provider] = min(timeout, p95 * 1.5 + 1)
+            fast.append((p95, provider))
+
+    ordered = [p for _, p in sorted(fast, key=lambda t: t[0], reverse=True)] + [p for _, p in sorted(slow, key=lambda t: t[0])]
+    for provider in skipped:
+        log.info("[%s] Skipping provider, p95 latency %.1fs and %d%% failures with %ds timeout" % (
+            provider, percentile(provider), failure_rate(provider) * 100, timeout))
+    return ordered, deadlines, skipped
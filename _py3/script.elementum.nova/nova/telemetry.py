@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Nova per-search filter telemetry
+"""
+
+import os
+import json
+import time
+from io import open
+from threading import Lock
+from elementum.provider import log
+from kodi_six import xbmc
+from .filtering import REJECT_CODES
+from .utils import ADDON_PROFILE, file_lock
+
+TELEMETRY_FILE = os.path.join(xbmc.translatePath(ADDON_PROFILE), 'filter_stats.json')
+MAX_SEARCHES = 50  # Only the most recent searches are kept
+COUNTERS = ('rows', 'accepted') + REJECT_CODES
+
+counters = {}
+lock = Lock()
+
+
+def reset():
+    """ Clears the counters, when a search starts
+    """
+    with lock:
+        counters.clear()
+
+
+def count(provider, rows, accepted, rejected):
+    """ Adds a verified page of a provider to its counters
+
+    Args:
+        provider  (str): Provider ID
+        rows      (int): Number of parsed rows
+        accepted  (int): Number of accepted results
+        rejected (list): ``(index, Rejection)`` tuples from ``Filtering.verify_batch``
+    """
+    with lock:
+        provider_counters = counters.get(provider)
+        if provider_counters is None:
+            provider_counters = counters[provider] = dict.fromkeys(COUNTERS, 0)
+        provider_counters['rows'] += rows
+        provider_counters['accepted'] += accepted
+        for _, rejection in rejected:
+            provider_counters[rejection.code] += 1
+
+
+def summary(method):
+    """ Logs the counters of the search as a single structured line
+
+    Args:
+        method (str): Type of search
+
+    Returns:
+        dict: Search type, counters of each provider and their totals
+    """
+    with lock:
+        providers = dict((provider, dict(provider_counters)) for provider, provider_counters in counters.items())
+    total = dict((counter, sum(c[counter] for c in providers.values())) for counter in COUNTERS)
+    data = {'time': int(time.time()), 'method': method, 'providers': providers, 'total': total}
+    log.info("Filter summary: %s" % json.dumps(data, sort_keys=True))
+    return data
+
+
+def save(data):
+    """ Appends a search summary to the ones saved in the addon profile
+
+    Summaries saved meanwhile by other processes are kept, and the file is
+    replaced atomically so readers never see a partial write.
+
+    Args:
+        data (dict): Summary returned by ``summary``
+    """
+    temp = '%s.%d.tmp' % (TELEMETRY_FILE, os.getpid())
+    try:
+        with file_lock(TELEMETRY_FILE):
+            searches = []
+            if os.path.exists(TELEMETRY_FILE):
+                try:
+                    with open(TELEMETRY_FILE, encoding='utf-8') as file:
+                        searches = json.load(file)
+                except Exception as e:
+                    log.debug("Reading filter stats error: %s" % repr(e))
+            searches = (searches + [data])[-MAX_SEARCHES:]
+            with open(temp, 'w', encoding='utf-8') as file:
+                file.write(u'%s' % json.dumps(searches))
+            try:
+                os.rename(temp, TELEMETRY_FILE)
+            except OSError:
+                # Windows doesn't replace existing files on rename
+                os.remove(TELEMETRY_FILE)
+                os.rename(temp, TELEMETRY_FILE)
+    except Exception as e:
+        log.debug("Saving filter stats error: %s" % repr(e))
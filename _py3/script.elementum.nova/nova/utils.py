@@ -8,7 +8,8 @@ from future.utils import PY2, PY3, iteritems
 
 import os
 import re
-from elementum.provider import get_setting
+from contextlib import contextmanager
+from .settings import get_setting
 from .providers.definitions import definitions
 if PY3:
     from urllib.parse import urlparse
@@ -30,6 +31,13 @@ PATH_TEMP = xbmc.translatePath("special://temp")
 if not ADDON_PATH:
     ADDON_PATH = '..'
 
+# Sign, digits optionally grouped by spaces, decimals and thousands, and the first letter of a unit
+NUMBER = re.compile(u'(-?)(\\d{1,3}(?:[ \\xa0]\\d{3})+(?!\\d)|\\d+|(?=[.,]\\d))((?:[.,]\\d+)*)\\W*([^\\W\\d_]?)', re.UNICODE)
+SEPARATOR = re.compile(r'[.,]')
+UNITS = {'K': 1000, u'К': 1000, 'M': 1000 ** 2, u'М': 1000 ** 2, 'G': 1000 ** 3, u'Г': 1000 ** 3, 'T': 1000 ** 4, u'Т': 1000 ** 4}
+NUMBERS_SIZE = 4096  # Parsed strings kept for the whole process, the memo is dropped when full
+numbers = {}
+
 
 class Magnet:
     """ Magnet link parsing class
@@ -171,6 +179,51 @@ def translation(id_value):
     return ADDON.getLocalizedString(id_value)
 
 
+def parse_number(string):
+    """ Parses the first number of a string, and the multiplier of the size unit following it
+
+    Handles ``1.2 GB``, ``1,5 ГБ``, ``700 MiB``, ``1 234,5 MB``, bare byte counts and seeds like ``12|3``.
+    A lone ``,`` or ``.`` is the decimal separator, repeated ones or the first of both are thousands
+    separators. Results are memoized, as pages repeat the same sizes and counts.
+
+    Args:
+        string (str): Number contained in a string
+
+    Returns:
+        tuple: The number as a float, or 0.0, and the unit multiplier, 1 without unit
+    """
+    if not string:
+        return 0.0, 1
+    if isinstance(string, (int, float)):
+        return float(string), 1
+
+    parsed = numbers.get(string)
+    if parsed is not None:
+        return parsed
+
+    match = NUMBER.search(string)
+    if match is None:
+        parsed = 0.0, 1
+    else:
+        sign, digits, decimals, unit = match.groups()
+        digits = digits.replace(' ', '').replace(u'\xa0', '')
+        separators = SEPARATOR.findall(decimals)
+        parts = SEPARATOR.split(decimals)[1:]
+        if separators and separators.count(separators[-1]) == 1:
+            # The last separator is the decimal one
+            digits += ''.join(parts[:-1])
+            fraction = parts[-1]
+        else:
+            digits += ''.join(parts)
+            fraction = '0'
+        parsed = float('%s%s.%s' % (sign, digits, fraction)), UNITS.get(unit.upper(), 1)
+
+    if len(numbers) >= NUMBERS_SIZE:
+        numbers.clear()
+    numbers[string] = parsed
+    return parsed
+
+
 def get_int(string):
     """ Utility method to convert a number contained in a string to an integer
 
@@ -180,19 +233,7 @@ def get_int(string):
     Returns:
         int: The number as an integer, or 0
     """
-    if not string:
-        return 0
-    try:
-        return int(string)
-    except:
-        try:
-            return int(get_float(string))
-        except:
-            pass
-    try:
-        return int(filter(type(string).isdigit, string))
-    except:
-        return 0
+    return int(parse_number(string)[0])
 
 
 def get_float(string):
@@ -204,26 +245,7 @@ def get_float(string):
     Returns:
         float: The number as a float, or 0.0
     """
-    if not string:
-        return float(0)
-    try:
-        return float(string)
-    except:
-        try:
-            cleaned = clean_number(string)
-            floated = re.findall(r'[\d.]+', cleaned)[0]
-            return float(floated)
-        except:
-            pass
-    try:
-        string = string[:clean_number(string).find('.')]
-        return float(filter(type(string).isdigit, string))
-    except:
-        pass
-    try:
-        return float(filter(type(string).isdigit, string))
-    except:
-        return float(0)
+    return parse_number(string)[0]
 
 
 def size_int(size_txt):
@@ -233,26 +255,10 @@ def size_int(size_txt):
         string (str): File size with suffix contained in a string, eg. ``1.21 GB``
 
     Returns:
-        float: The number of bytes as a float, or 0.0
+        int: The number of bytes, or 0
     """
-    try:
-        return float(size_txt)
-    except:
-        try:
-            size_txt = size_txt.upper()
-            size = get_float(size_txt)
-            if 'K' in size_txt:
-                size *= 1e3
-            if 'M' in size_txt:
-                size *= 1e6
-            if 'G' in size_txt:
-                size *= 1e9
-            if 'T' in size_txt:
-                size *= 1e12
-            return size
-        except:
-            pass
-    return 0
+    number, unit = parse_number(size_txt)
+    return int(round(number * unit))
 
 
 def clean_number(string):
@@ -332,6 +338,28 @@ def clear_cache():
                 os.remove(os.path.join(cookies_path, f))
 
 
+@contextmanager
+def file_lock(path):
+    """ Exclusive lock between processes for a file, using a ``.lock`` file next to it
+
+    Only available where ``fcntl`` is, elsewhere it doesn't lock anything.
+
+    Args:
+        path (str): Path of the file to lock
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
 def encode_dict(dict_in):
     """ Encodes dict values to UTF-8
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Nova provider parsing benchmark
+
+Replays recorded search pages through the parser of each provider outside of
+Kodi, with stand-ins for the Kodi and Elementum modules, to track parsing
+regressions between releases.
+
+Fixtures are the raw search pages of providers, saved as ``<provider>.html``,
+or ``<provider>.json`` for API providers, in ``scripts/fixtures``. Each one is
+run through ``extract_torrents`` or ``extract_from_api`` and ``generate_payload``,
+the same way a search does, with subpages disabled so nothing is fetched.
+The shipped fixtures are synthetic pages of 50 results laid out the way each
+definition expects, so runs are offline and repeatable. They can be replaced
+with real pages with ``--record``.
+
+Usage:
+    python scripts/benchmark.py [-n REPEAT] [-s KEY=VALUE] [PROVIDER ...]
+    python scripts/benchmark.py --record QUERY PROVIDER [PROVIDER ...]
+
+Settings default to those of ``resources/settings.xml`` and can be overridden
+with ``-s``. Recording needs network access and uses the search URL of the
+provider, so private providers also need their credentials as settings.
+Requires Python 3 and the ``future`` package.
+"""
+
+import os
+import sys
+import time
+import types
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_PATH = os.path.join(ADDON_PATH, 'scripts', 'fixtures')
+PATH_KODI = tempfile.mkdtemp(prefix='nova-benchmark-')
+
+log = logging.getLogger('nova')
+settings = {}
+
+
+def read_settings():
+    """ Default values of all settings, from the addon's ``settings.xml``
+    """
+    values = {}
+    for setting in ET.parse(os.path.join(ADDON_PATH, 'resources', 'settings.xml')).iter('setting'):
+        if setting.get('id'):
+            values[setting.get('id')] = setting.get('default', '')
+    return values
+
+
+def translate_path(path):
+    if path.startswith('special://'):
+        return os.path.join(PATH_KODI, path[len('special://'):])
+    return path
+
+
+def get_setting(key, converter=str, choices=None):
+    """ Same conversions as ``elementum.provider.get_setting``
+    """
+    value = settings.get(key, '')
+    if converter is bool:
+        return value == 'true'
+    elif converter is int:
+        return int(float(value or 0))
+    elif converter is str:
+        return value
+    elif isinstance(choices, (list, tuple)):
+        return choices[int(value)]
+    raise TypeError("Acceptable converters are str, bool and int")
+
+
+def append_headers(uri, headers):
+    return uri + '|' + '|'.join('%s=%s' % header for header in headers.items())
+
+
+class Addon:
+    def __init__(self, id='script.elementum.nova'):
+        self.id = id
+
+    def getAddonInfo(self, key):
+        if self.id != 'script.elementum.nova':
+            return ''
+        return {
+            'id': self.id,
+            'name': 'Nova',
+            'path': ADDON_PATH,
+            'profile': 'special://profile/addon_data/%s/' % self.id,
+            'icon': os.path.join(ADDON_PATH, 'icon.png'),
+            'version': '0.0.0',
+        }.get(key, '')
+
+    def getSetting(self, key):
+        return settings.get(key, '') if self.id == 'script.elementum.nova' else ''
+
+    def getLocalizedString(self, id):
+        return ''
+
+
+class Dialog:
+    def notification(self, *args, **kwargs):
+        pass
+
+
+class DialogProgressBG:
+    def create(self, *args, **kwargs):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def module(name, **attributes):
+    stub = types.ModuleType(name)
+    stub.__dict__.update(attributes)
+    sys.modules[name] = stub
+    return stub
+
+
+def install_stubs():
+    """ Registers stand-ins for the modules only available inside Kodi and Elementum
+    """
+    xbmc = module('xbmc', ISO_639_1=0, translatePath=translate_path, getLanguage=lambda *args: 'en',
+                  log=lambda *args, **kwargs: None, LOGDEBUG=0, LOGINFO=1, LOGERROR=4)
+    xbmcaddon = module('xbmcaddon', Addon=Addon)
+    xbmcgui = module('xbmcgui', Dialog=Dialog, DialogProgressBG=DialogProgressBG)
+    xbmcvfs = module('xbmcvfs', translatePath=translate_path, exists=os.path.exists)
+    identity = lambda value, *args: value
+    kodi_six = module('kodi_six', xbmc=xbmc, xbmcaddon=xbmcaddon, xbmcgui=xbmcgui, xbmcvfs=xbmcvfs,
+                      py2_encode=identity, py2_decode=identity)
+    kodi_six.utils = module('kodi_six.utils', py2_encode=identity, py2_decode=identity)
+    elementum = module('elementum')
+    elementum.provider = module('elementum.provider', log=log, get_setting=get_setting,
+                                append_headers=append_headers, register=lambda *args: None)
+
+
+class RecordedClient:
+    """ Client stand-in serving a recorded page
+    """
+    def __init__(self, content):
+        self.content = content
+        self.token = None
+        self.status = 200
+        self.headers = {}
+
+    def cookies(self):
+        return []
+
+    def save_cookies(self):
+        pass
+
+
+def search_payload(query):
+    return {
+        'query': query,
+        'title': query,
+        'titles': {'source': query, 'original': query},
+        'proxy_url': '',
+        'internal_proxy_url': '',
+        'has_special': False,
+    }
+
+
+def fixture_path(provider, definition):
+    return os.path.join(FIXTURES_PATH, provider + ('.json' if 'is_api' in definition else '.html'))
+
+
+def run_page(provider, content):
+    """ Runs a recorded page through a provider's extraction and filtering
+
+    Returns:
+        tuple: Number of parsed rows, and number of accepted results
+    """
+    from nova.nova import extract_torrents, extract_from_api
+    from nova.provider import generate_payload
+    from nova.filtering import Filtering
+    from nova.providers.definitions import definitions
+
+    filtering = Filtering()
+    filtering.use_general(provider, search_payload(''))
+    generator = extract_from_api if 'is_api' in definitions[provider] else extract_torrents
+
+    rows = [0]
+
+    def counted():
+        for row in generator(provider, RecordedClient(content)):
+            rows[0] += 1
+            yield row
+
+    results = generate_payload(provider, counted(), filtering)
+    return rows[0], len(results)
+
+
+def benchmark(provider, content, repeat):
+    """ Times a recorded page and measures the peak memory of a separate traced run
+
+    Returns:
+        dict: Rows, accepted results, rows per second, milliseconds per page and peak megabytes
+    """
+    run_page(provider, content)  # Warm up caches of compiled expressions and row plans
+
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows, results = run_page(provider, content)
+        elapsed.append(time.perf_counter() - start)
+    best = min(elapsed)
+
+    tracemalloc.start()
+    try:
+        run_page(provider, content)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'results': results,
+        'rows_per_second': rows / best if best else 0.0,
+        'ms_per_page': best * 1000,
+        'peak_mb': peak / 1048576.0,
+    }
+
+
+def run(providers, repeat):
+    from nova.providers.definitions import definitions
+
+    if not providers:
+        providers = sorted(p for p in definitions if os.path.exists(fixture_path(p, definitions[p])))
+    if not providers:
+        print("No fixtures in %s, record some with --record" % FIXTURES_PATH)
+        return 1
+
+    print("%-16s %8s %8s %12s %10s %9s" % ('provider', 'rows', 'results', 'rows/s', 'ms/page', 'peak MB'))
+    failed = 0
+    for provider in providers:
+        if provider not in definitions:
+            print("%-16s unknown provider" % provider)
+            failed += 1
+            continue
+        path = fixture_path(provider, definitions[provider])
+        if not os.path.exists(path):
+            print("%-16s missing fixture %s" % (provider, path))
+            failed += 1
+            continue
+        with open(path, encoding='utf-8') as file:
+            content = file.read()
+
+        # Subpages would have to be fetched, only the search page is recorded
+        definitions[provider]['subpage'] = False
+        try:
+            result = benchmark(provider, content, repeat)
+        except Exception as e:
+            print("%-16s failed: %s" % (provider, repr(e)))
+            failed += 1
+            continue
+        print("%-16s %8d %8d %12.0f %10.2f %9.2f" % (
+            provider, result['rows'], result['results'], result['rows_per_second'], result['ms_per_page'], result['peak_mb']))
+    return 1 if failed else 0
+
+
+def record(query, providers):
+    """ Searches providers for a query and saves their first search page as fixtures
+    """
+    from nova.nova import extract_torrents, extract_from_api
+    from nova.provider import process
+    from nova.filtering import Filtering
+    from nova.providers.definitions import definitions
+
+    if not os.path.exists(FIXTURES_PATH):
+        os.makedirs(FIXTURES_PATH)
+
+    failed = 0
+    for provider in providers:
+        if provider not in definitions:
+            print("%-16s unknown provider" % provider)
+            failed += 1
+            continue
+        path = fixture_path(provider, definitions[provider])
+        generator = extract_from_api if 'is_api' in definitions[provider] else extract_torrents
+        saved = []
+
+        def recorder(provider, client):
+            if not saved and client.content:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(client.content)
+                saved.append(path)
+            return generator(provider, client)
+
+        payload = search_payload(query)
+        filtering = Filtering()
+        filtering.use_general(provider, payload)
+        try:
+            process(provider, recorder, filtering, payload['has_special'])
+        except Exception as e:
+            log.error("[%s] Recording failed: %s" % (provider, repr(e)))
+        if saved:
+            print("%-16s saved %s" % (provider, path))
+        else:
+            print("%-16s no page to save" % provider)
+            failed += 1
+    return 1 if failed else 0
+
+
+def main():
+    arguments = argparse.ArgumentParser(description="Benchmarks provider parsing on recorded search pages")
+    arguments.add_argument('providers', nargs='*', help="Provider IDs, defaults to all providers with a fixture")
+    arguments.add_argument('-n', '--repeat', type=int, default=5, help="Timed runs of each page, the best one is reported")
+    arguments.add_argument('-s', '--setting', action='append', default=[], metavar='KEY=VALUE', help="Overrides an addon setting")
+    arguments.add_argument('-r', '--record', metavar='QUERY', help="Records search pages of the given providers instead")
+    arguments.add_argument('-v', '--verbose', action='store_true', help="Shows the addon's debug log")
+    args = arguments.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR, format='%(levelname)s %(message)s')
+    settings.update(read_settings())
+    for setting in args.setting:
+        key, _, value = setting.partition('=')
+        settings[key] = value
+
+    install_stubs()
+    sys.path.insert(0, ADDON_PATH)
+    try:
+        if args.record:
+            if not args.providers:
+                arguments.error("providers to record are required")
+            return record(args.record, args.providers)
+        return run(args.providers, max(1, args.repeat))
+    finally:
+        shutil.rmtree(PATH_KODI, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Nova web client checks against a local HTTP stand-in
+
+Runs ``Client`` with the asyncio engine, and then with urllib, against a
+threaded HTTP/1.1 server on localhost covering cookies, redirects, gzip,
+charset decoding, chunked bodies with trailers and kept-alive connections.
+Uses the same stand-ins for the Kodi and Elementum modules as the benchmark.
+
+Usage:
+    python scripts/test_client.py [-v]
+
+Requires Python 3 and the ``future`` package.
+"""
+
+import gzip
+import shutil
+import unittest
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import benchmark
+
+PAGE = u'<html><head><title>Матрица</title></head><body>Матрица (1999) 1080p</body></html>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Stand-in tracker, each path exercises one feature of the client
+    """
+    protocol_version = 'HTTP/1.1'
+    connections = set()  # Client ports of all connections the server accepted
+
+    def log_message(self, *args):
+        pass
+
+    def send_page(self, body, status=200, content_type='text/html; charset=utf-8', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address[1])
+        path = self.path.split('?')[0]
+        if path == '/login':
+            self.send_page(b'form', headers=[('Set-Cookie', 'sid=abc123; Path=/')])
+        elif path == '/cookie':
+            self.send_page((u'cookie=%s' % self.headers.get('Cookie', '')).encode('utf-8'))
+        elif path == '/redirect':
+            self.send_page(b'', status=302, headers=[('Location', '/redirect/final')])
+        elif path == '/redirect/final':
+            self.send_page((u'%s %s' % (self.command, PAGE)).encode('utf-8'))
+        elif path == '/gzip':
+            self.send_page(gzip.compress(PAGE.encode('utf-8')), headers=[('Content-Encoding', 'gzip')])
+        elif path == '/cp1251/header':
+            self.send_page(PAGE.encode('windows-1251'), content_type='text/html; charset=windows-1251')
+        elif path == '/cp1251/meta':
+            self.send_page(PAGE.replace(u'<head>', u'<head><meta charset="windows-1251">').encode('windows-1251'), content_type='text/html')
+        elif path == '/chunked':
+            body = PAGE.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Trailer', 'X-Checksum')
+            self.end_headers()
+            for start in range(0, len(body), 16):
+                chunk = body[start:start + 16]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\nX-Checksum: 1234\r\n\r\n')
+        elif path == '/plain':
+            self.send_page(b'plain')
+        else:
+            self.send_page(b'not found', status=404)
+
+    def do_POST(self):
+        Handler.connections.add(self.client_address[1])
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/login':
+            self.send_page(b'', status=303, headers=[('Location', '/redirect/final'), ('Set-Cookie', 'user=%s; Path=/' % data.decode('ascii'))])
+        else:
+            self.send_page(b'posted ' + data)
+
+
+class ClientTest(unittest.TestCase):
+    """ Checks of ``Client``, the engine is picked by subclasses
+    """
+    use_asyncio = True
+
+    @classmethod
+    def setUpClass(cls):
+        import nova.client
+        cls.module = nova.client
+        cls.engine = nova.client.use_asyncio
+        nova.client.use_asyncio = cls.use_asyncio
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.module.use_asyncio = cls.engine
+        cls.module.cookie_jar.clear()
+
+    def open(self, path, **kwargs):
+        client = self.module.Client()
+        self.assertTrue(client.open(self.url + path, **kwargs), "%s failed with %s" % (path, client.status))
+        return client
+
+    def test_cookies(self):
+        self.open('/login')
+        self.assertEqual(self.open('/cookie').content, u'cookie=sid=abc123')
+
+    def test_redirect(self):
+        client = self.open('/redirect')
+        self.assertEqual(client.status, 200)
+        self.assertEqual(client.content, u'GET ' + PAGE)
+
+    def test_post_redirect(self):
+        client = self.open('/login', post_data={'name': 'nova'})
+        self.assertEqual(client.content, u'GET ' + PAGE)
+        self.assertIn(u'user=name=nova', self.open('/cookie').content)
+
+    def test_gzip(self):
+        self.assertEqual(self.open('/gzip').content, PAGE)
+
+    def test_charset(self):
+        self.assertEqual(self.open('/cp1251/header').content, PAGE)
+        self.assertIn(u'Матрица (1999)', self.open('/cp1251/meta').content)
+
+    def test_error_status(self):
+        client = self.module.Client()
+        self.assertFalse(client.open(self.url + '/missing'))
+        self.assertEqual(client.status, 404)
+
+    def test_keep_alive(self):
+        # Trailers left on the connection would corrupt the next response sent on it
+        Handler.connections.clear()
+        self.assertEqual(self.open('/chunked').content, PAGE)
+        self.assertEqual(self.open('/plain').content, u'plain')
+        self.assertEqual(len(Handler.connections), 1)
+
+    def test_post_fresh_connection(self):
+        if not self.use_asyncio:
+            self.skipTest("urllib reuses connections for posts")
+        Handler.connections.clear()
+        self.open('/plain')
+        self.assertEqual(self.open('/echo', post_data={'q': '1'}).content, u'posted q=1')
+        self.assertEqual(len(Handler.connections), 2)
+
+
+class UrllibClientTest(ClientTest):
+    use_asyncio = False
+
+
+def setUpModule():
+    benchmark.logging.basicConfig(level=benchmark.logging.ERROR, format='%(levelname)s %(message)s')
+    benchmark.settings.update(benchmark.read_settings())
+    benchmark.install_stubs()
+    benchmark.sys.path.insert(0, benchmark.ADDON_PATH)
+
+
+def tearDownModule():
+    shutil.rmtree(benchmark.PATH_KODI, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()